@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+
+"""BOXER benchmarks
+================
+
+Measures the time BOXER itself spends orchestrating a group of containers, apart from Docker.
+
+Synthetic groups of 10, 100 and 1000 boxes are generated with the "boxer init" command and
+fake "docker" and "docker-compose" executables are placed on the PATH. The fake executables
+only print their arguments and optionally sleep, so everything runs offline and the measured
+time is mostly the overhead of BOXER: scanning the group, generating compose files, spawning
+hook scripts, fingerprinting, etc.
+
+Every command is executed end to end via the "bin/boxer" script:
+    build          first build of the group
+    build-again    second build, nothing was changed in the group
+    build-force    build of all of the boxes with the "--force" flag
+    start          generate "docker-compose.run.yml" and start the group
+    exec           execute a command in one of the containers
+    stop           stop the group
+
+Usage:
+    python benchmarks/run_benchmarks.py --sizes 10,100,1000 --repeat 3 --json bench_output.json
+
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FAKE_DOCKER = """#!/bin/bash
+echo "docker $@"
+sleep ${BOXER_BENCH_DELAY:-0}
+exit 0
+"""
+
+FAKE_DOCKER_COMPOSE = """#!/bin/bash
+echo "docker-compose $@"
+sleep ${BOXER_BENCH_DELAY:-0}
+exit 0
+"""
+
+COMMANDS = ['build', 'build-again', 'build-force', 'start', 'exec', 'stop', ]
+
+
+def prepare_fake_binaries(work_dir):
+    bin_dir = os.path.join(work_dir, 'bin')
+    os.mkdir(bin_dir)
+    for filename, src in (('docker', FAKE_DOCKER, ), ('docker-compose', FAKE_DOCKER_COMPOSE, ), ):
+        open(os.path.join(bin_dir, filename), 'w').write(src)
+        os.chmod(os.path.join(bin_dir, filename), 0o755)
+    return bin_dir
+
+
+def prepare_environment(bin_dir, delay):
+    env = os.environ.copy()
+    env['PATH'] = bin_dir + os.pathsep + env.get('PATH', '')
+    env['PYTHONPATH'] = os.path.join(ROOT_DIR, 'src') + os.pathsep + env.get('PYTHONPATH', '')
+    env['BOXER_BENCH_DELAY'] = str(delay)
+    return env
+
+
+def run_boxer(work_dir, env, args):
+    cmd = [sys.executable, os.path.join(ROOT_DIR, 'bin', 'boxer'), ] + args
+    started = time.monotonic()
+    ret = subprocess.run(cmd, cwd=work_dir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode
+    duration = time.monotonic() - started
+    if ret != 0:
+        print(f'command [{" ".join(args)}] failed with exit code {ret}')
+        sys.exit(ret)
+    return duration
+
+
+def generate_group(work_dir, env, group_name, size):
+    containers = [f'c{i}' for i in range(size)]
+    run_boxer(work_dir, env, ['--group-name', group_name, 'init', ] + containers)
+    group_dir = os.path.join(work_dir, group_name + '.boxes')
+    for pos, container in enumerate(containers):
+        box_dir = os.path.join(group_dir, 'box.' + container)
+        open(os.path.join(box_dir, 'build.yml'), 'w').write(
+            f'  {container}:\n    container_name: build_{container}_1\n    build:\n      context: ./box.{container}\n')
+        open(os.path.join(box_dir, 'run.yml'), 'w').write(
+            f'  {container}:\n    image: bench-{container}\n')
+        open(os.path.join(box_dir, 'commit.sh'), 'w').write(
+            f'docker commit build_{container}_1 bench-{container}\n')
+        open(os.path.join(box_dir, 'push.sh'), 'w').write(
+            f'docker push bench-{container}\n')
+        if pos % 10 == 1:
+            os.rename(os.path.join(box_dir, 'exec.sh'), os.path.join(box_dir, 'exec-1.sh'))
+    return containers
+
+
+def benchmark_group(work_dir, env, size, repeat, jobs):
+    group_name = f'bench{size}'
+    containers = generate_group(work_dir, env, group_name, size)
+    options = ['--quite', '--jobs', str(jobs), '--group-name', group_name, ]
+    commands = {
+        'build': options + ['build', ],
+        'build-again': options + ['build', ],
+        'build-force': options + ['--force', 'build', ],
+        'start': options + ['start', ],
+        'exec': ['--group-name', group_name, '--container', containers[0], 'exec', 'true', ],
+        'stop': options + ['stop', ],
+    }
+    results = {command: [] for command in COMMANDS}
+    for _ in range(repeat):
+        for command in COMMANDS:
+            if command == 'build':
+                manifest = os.path.join(work_dir, group_name + '.boxes', 'build.manifest.json')
+                if os.path.isfile(manifest):
+                    os.remove(manifest)
+            results[command].append(run_boxer(work_dir, env, commands[command]))
+    return results
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'min': samples[0],
+        'median': samples[len(samples) // 2],
+        'max': samples[-1],
+    }
+
+
+def print_report(report):
+    print(f"BOXER benchmarks, python {report['python']} on {report['platform']}, {report['jobs']} jobs, fake docker delay {report['delay']:.2f}s")
+    print(f"{'boxes':>6}  {'command':<12} {'min':>10} {'median':>10} {'max':>10}")
+    for size, results in report['results'].items():
+        for command in COMMANDS:
+            summary = results[command]
+            print(f"{size:>6}  {command:<12} {summary['min']:>9.3f}s {summary['median']:>9.3f}s {summary['max']:>9.3f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='run_benchmarks',
+        description='Measures the orchestration overhead of BOXER with fake docker and docker-compose executables',
+    )
+    parser.add_argument(
+        '--sizes', dest='sizes', default='10,100,1000',
+        help='Comma separated numbers of boxes in the generated groups',
+    )
+    parser.add_argument(
+        '--repeat', dest='repeat', type=int, default=3,
+        help='How many times every command is executed',
+    )
+    parser.add_argument(
+        '--jobs', dest='jobs', type=int, default=os.cpu_count() or 1,
+        help='Value of the "--jobs" argument passed to BOXER',
+    )
+    parser.add_argument(
+        '--delay', dest='delay', type=float, default=0.0,
+        help='Number of seconds every fake "docker" and "docker-compose" call will sleep',
+    )
+    parser.add_argument(
+        '--json', dest='json_path',
+        help='Also save the report to the given JSON file',
+    )
+    parser.add_argument(
+        '--keep', dest='keep', action='store_const', const=True, default=False,
+        help='Do not remove the temporary folder with generated groups',
+    )
+    args = parser.parse_args()
+
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'jobs': args.jobs,
+        'delay': args.delay,
+        'repeat': args.repeat,
+        'results': {},
+    }
+    work_dir = tempfile.mkdtemp(prefix='boxer_bench_')
+    try:
+        env = prepare_environment(prepare_fake_binaries(work_dir), args.delay)
+        for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+            results = benchmark_group(work_dir, env, size, args.repeat, args.jobs)
+            report['results'][str(size)] = {command: summarize(samples) for command, samples in results.items()}
+    finally:
+        if args.keep:
+            print(f'generated groups are kept in {work_dir}')
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    print_report(report)
+    if args.json_path:
+        open(args.json_path, 'w').write(json.dumps(report, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1 @@
+from boxer.boxer import Group, BoxerError, ExecResult  # @UnusedImport
@@ -23,193 +23,2786 @@ Using the boxer tool involves the following steps:
     start   Will spawn all of the containers in the target network group from cached docker images
     exec    Executes a command via shell inside of one of the running containers
     stop    Terminates all running containers in the target network group
+    checkpoint  Saves state of all running containers and their volumes in the target network group
+    reset   Brings running containers in the target network group back to the saved checkpoint
+    stats   Collects CPU, memory and IO usage of all running containers in the target network group
+    watch   Builds again and recreates only the containers whose files were changed, until Ctrl+C is pressed
+    context-report  Shows how much data every container sends to docker as a build context
+    plan    Estimates the time of "build" or "start" from previous runs and shows the critical path
+    export  Saves images of all containers into the local cache folder, every image layer is stored only once
+    import  Loads images which are missing in docker from the local cache folder
 
 """
 
 import os
+import re
 import sys
+import gzip
+import json
+import fcntl
+import shutil
+import time
+import shlex
+import uuid
+import signal
+import struct
+import select
+import tarfile
+import sqlite3
+import fnmatch
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
+import asyncio
 import argparse
+import collections
+import contextvars
+import functools
 import subprocess
+import statistics
 
 
-VERBOSE = ''
-QUITE_PULL = ''
-ALIAS = ''
+OUTPUTS = {}
+LOG_BACKUPS = 3
+LOG_TAIL_LINES = 20
+HISTORY_RUNS = 5
+
+
+class Settings(object):
+    """
+    Options of a single group of containers.
+    Every "Group" object keeps its own settings and activates them while one of its commands is running,
+    so several groups can be used at the same time from different threads of the same process.
+    """
+
+    def __init__(self, alias='', quite=False, jobs=None, force=False, timeout=None, cache_dir=None, build_backend='compose',
+                 log_max_size=10 * 1024 * 1024, log_compress=False, print_timings=False, pipeline=False):
+        self.alias = alias
+        self.quite = quite
+        self.jobs = jobs or os.cpu_count() or 1
+        self.force = force
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.build_backend = build_backend
+        self.log_max_size = log_max_size
+        self.log_compress = log_compress
+        self.print_timings = print_timings
+        self.pipeline = pipeline
+        self.timings = None
+
+    @property
+    def quite_pull(self):
+        return ['--quiet-pull', ] if self.quite else []
+
+
+SETTINGS = contextvars.ContextVar('SETTINGS', default=Settings())
+
+
+def get_settings():
+    return SETTINGS.get()
+
+
+class BoxerError(Exception):
+
+    def __init__(self, message, exit_code=1):
+        super().__init__(message)
+        self.exit_code = exit_code
 
 
 def check_ret(ret):
     if ret == 0:
         return
     print('<BOXER> FAILED!')
-    sys.exit(ret)
+    write_timings_report()
+    raise BoxerError(f'failed with exit code {ret}', ret if isinstance(ret, int) and ret > 0 else 1)
+
+
+def start_timings(group_name, command):
+    get_settings().timings = {
+        'group': group_name,
+        'command': command,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'started': time.monotonic(),
+        'stages': [],
+    }
+
+
+def timed_stage(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = get_settings().timings
+        if timings is None:
+            return func(*args, **kwargs)
+        stage = {
+            'name': func.__name__.replace('execute_', '', 1),
+            'started': time.monotonic() - timings['started'],
+            'finished': None,
+            'exit_code': None,
+            'boxes': {},
+        }
+        timings['stages'].append(stage)
+        ret = func(*args, **kwargs)
+        stage['finished'] = time.monotonic() - timings['started']
+        stage['exit_code'] = ret
+        return ret
+    return wrapper
+
+
+def record_box_timing(box_name, script, dependencies, ready, started, finished, ret):
+    timings = get_settings().timings
+    if timings is None or not timings['stages']:
+        return
+    timings['stages'][-1]['boxes'][box_name] = {
+        'script': script,
+        'dependencies': sorted(dependencies),
+        'ready': ready - timings['started'],
+        'started': None if started is None else started - timings['started'],
+        'finished': None if finished is None else finished - timings['started'],
+        'exit_code': ret,
+    }
+
+
+def find_critical_path(stage):
+    boxes = {box_name: box for box_name, box in stage['boxes'].items() if box['finished'] is not None}
+    if not boxes:
+        return []
+    box_name = max(boxes, key=lambda name: boxes[name]['finished'])
+    path = []
+    while box_name:
+        path.insert(0, box_name)
+        previous = [name for name in boxes[box_name]['dependencies'] if name in boxes]
+        box_name = max(previous, key=lambda name: boxes[name]['finished']) if previous else None
+    return path
+
+
+def write_timings_report():
+    timings = get_settings().timings
+    if timings is None:
+        return None
+    group_name = timings['group']
+    report = {
+        'group': group_name,
+        'command': timings['command'],
+        'date': timings['date'],
+        'wall_time': time.monotonic() - timings['started'],
+        'running_time': 0.0,
+        'waiting_time': 0.0,
+        'stages': [],
+        'critical_path': [],
+    }
+    for stage in timings['stages']:
+        finished = stage['finished'] if stage['finished'] is not None else report['wall_time']
+        stage_report = {
+            'name': stage['name'],
+            'started': stage['started'],
+            'wall_time': finished - stage['started'],
+            'exit_code': stage['exit_code'],
+            'boxes': {},
+        }
+        for box_name, box in sorted(stage['boxes'].items()):
+            box_report = {
+                'script': box['script'],
+                'exit_code': box['exit_code'],
+                'waiting_time': 0.0,
+                'running_time': 0.0,
+            }
+            if box['started'] is not None:
+                box_report['waiting_time'] = box['started'] - stage['started']
+                box_report['queued_time'] = box['started'] - box['ready']
+                box_report['running_time'] = box['finished'] - box['started']
+                report['waiting_time'] += box_report['waiting_time']
+                report['running_time'] += box_report['running_time']
+            stage_report['boxes'][box_name] = box_report
+        report['stages'].append(stage_report)
+        report['critical_path'].append({
+            'stage': stage['name'],
+            'wall_time': stage_report['wall_time'],
+            'boxes': find_critical_path(stage),
+        })
+    path = os.path.join(group_name, f'timings.{timings["command"]}.json')
+    if os.path.isdir(group_name):
+        open(path, 'w').write(json.dumps(report, indent=2))
+        print(f'<BOXER> timings report saved to [{path}]')
+        write_timings_history(report)
+    if get_settings().print_timings:
+        print_timings_report(report)
+    return report
+
+
+def print_timings_report(report):
+    print(f'<BOXER> timings of [{report["command"]}] in {report["group"]}/')
+    print('<BOXER>     {:<32} {:>6} {:>9} {:>9}'.format('stage / box', 'exit', 'waiting', 'running'))
+    for stage in report['stages']:
+        exit_code = '' if stage['exit_code'] is None else stage['exit_code']
+        print('<BOXER>     {:<32} {:>6} {:>9} {:>8.1f}s'.format(stage['name'], exit_code, '', stage['wall_time']))
+        for box_name, box in stage['boxes'].items():
+            exit_code = '-' if box['exit_code'] is None else box['exit_code']
+            print('<BOXER>       {:<30} {:>6} {:>8.1f}s {:>8.1f}s'.format(box_name, exit_code, box['waiting_time'], box['running_time']))
+    critical_path = []
+    for item in report['critical_path']:
+        if item['boxes']:
+            critical_path.append('{}({})'.format(item['stage'], ' > '.join(item['boxes'])))
+        else:
+            critical_path.append(item['stage'])
+    print(f'<BOXER>     critical path: {" -> ".join(critical_path)}')
+    print('<BOXER>     total: {:.1f}s, running {:.1f}s, waiting {:.1f}s'.format(report['wall_time'], report['running_time'], report['waiting_time']))
+
+
+def open_timings_history(group_name):
+    db = sqlite3.connect(os.path.join(group_name, 'timings.db'))
+    db.execute('CREATE TABLE IF NOT EXISTS timings (date TEXT, command TEXT, stage TEXT, box TEXT, script TEXT, duration REAL)')
+    return db
+
+
+def write_timings_history(report):
+    rows = []
+    for stage in report['stages']:
+        if stage['exit_code'] != 0:
+            continue
+        rows.append((report['date'], report['command'], stage['name'], '', '', stage['wall_time'], ))
+        for box_name, box in stage['boxes'].items():
+            if box['exit_code'] == 0:
+                rows.append((report['date'], report['command'], stage['name'], box_name.split('/')[0], box['script'], box['running_time'], ))
+    if not rows:
+        return
+    try:
+        db = open_timings_history(report['group'])
+        with db:
+            db.executemany('INSERT INTO timings VALUES (?, ?, ?, ?, ?, ?)', rows)
+        db.close()
+    except sqlite3.Error as e:
+        print(f'<BOXER> failed to save timings history: {e}')
+
+
+def read_timings_history(group_name):
+    history = {'stages': {}, 'boxes': {}, }
+    if not os.path.isfile(os.path.join(group_name, 'timings.db')):
+        return history
+    durations = collections.defaultdict(list)
+    try:
+        db = open_timings_history(group_name)
+        for command, stage, box_name, script, duration in db.execute('SELECT command, stage, box, script, duration FROM timings ORDER BY rowid DESC'):
+            if box_name:
+                key = ('boxes', (box_name, script, ))
+            else:
+                key = ('stages', (command, stage, ))
+            if len(durations[key]) < HISTORY_RUNS:
+                durations[key].append(duration)
+        db.close()
+    except sqlite3.Error as e:
+        print(f'<BOXER> failed to read timings history: {e}')
+    for (kind, key), values in durations.items():
+        history[kind][key] = statistics.median(values)
+    return history
+
+
+def estimate_box_jobs(jobs, durations):
+    """
+    Expected duration of every job, a box which was never executed before gets the average duration of the same script in other boxes.
+    """
+    known = collections.defaultdict(list)
+    for (_, script), duration in durations.items():
+        known[script].append(duration)
+    estimates = {}
+    for job_name, (label, _) in jobs.items():
+        duration = durations.get((job_name.split('/')[0], label, ))
+        if duration is None:
+            duration = statistics.mean(known[label]) if known[label] else 0.0
+        estimates[job_name] = duration
+    return estimates
+
+
+def rank_box_jobs(jobs, dependencies, estimates):
+    """
+    Expected time from the start of every job till the end of the longest chain of jobs which depend on it,
+    jobs with the highest rank are started first.
+    """
+    dependents = collections.defaultdict(set)
+    for job_name in jobs:
+        for other_job_name in dependencies.get(job_name, set()):
+            dependents[other_job_name].add(job_name)
+    ranks = {}
+
+    def _rank(job_name, visiting):
+        if job_name not in ranks:
+            visiting.add(job_name)
+            following = [_rank(other, visiting) for other in dependents[job_name] if other in jobs and other not in visiting]
+            ranks[job_name] = estimates[job_name] + max(following, default=0.0)
+            visiting.discard(job_name)
+        return ranks[job_name]
+
+    for job_name in jobs:
+        _rank(job_name, set())
+    return ranks
 
 
 def no_comments(src):
-    out = ''
+    out = []
     for line in src.splitlines(keepends=True):
         if line.strip().startswith('#'):
             continue
-        out += line
-    return out
+        out.append(line)
+    return ''.join(out)
 
 
-def generate_docker_compose_build_file(group_name):
-    yml = ''
-    if os.path.isfile(os.path.join(group_name, 'build.header.yml')):
-        yml += no_comments(open(os.path.join(group_name, 'build.header.yml')).read())
-    else:
-        yml += """version: '3.1'
+DEFAULT_HEADER = """version: '3.1'
 
 services:
 
 """
-    for box_name in os.listdir(group_name):
-        if not box_name.startswith('box.'):
-            continue
-        if not os.path.isdir(os.path.join(group_name, box_name)):
-            continue
-        if not os.path.isfile(os.path.join(group_name, box_name, 'build.yml')):
-            continue
-        yml += no_comments(open(os.path.join(group_name, box_name, 'build.yml')).read()) + '\n'
-    if os.path.isfile(os.path.join(group_name, 'build.footer.yml')):
-        yml += no_comments(open(os.path.join(group_name, 'build.footer.yml')).read())
-    open(os.path.join(group_name, 'docker-compose.build.yml'), 'w').write(yml)
-    print(f'<BOXER> generated [{group_name}/docker-compose.build.yml] file')
+
+
+class GroupIndex(object):
+    """
+    Keeps the list of boxes in the group together with their files, so the group folder
+    is only scanned again when something was added or removed there.
+    The index is stored in the "group.index.json" file inside of the group folder.
+    """
+
+    def __init__(self, group_name):
+        self.group_name = group_name
+        self.path = os.path.join(group_name, 'group.index.json')
+        self.mtime = None
+        self.boxes = {}
+        self.fragments = {}
+        self.generated = {}
+        self.modified = False
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            data = json.loads(open(self.path).read())
+        except ValueError:
+            return
+        self.mtime = data.get('mtime')
+        self.boxes = data.get('boxes', {})
+        self.fragments = data.get('fragments', {})
+        self.generated = data.get('generated', {})
+
+    def save(self):
+        if not self.modified:
+            return
+        open(self.path, 'w').write(json.dumps({
+            'mtime': self.mtime,
+            'boxes': self.boxes,
+            'fragments': self.fragments,
+            'generated': self.generated,
+        }))
+        self.modified = False
+
+    def refresh(self):
+        mtime = os.stat(self.group_name).st_mtime_ns
+        if mtime != self.mtime:
+            boxes = {}
+            with os.scandir(self.group_name) as entries:
+                for entry in entries:
+                    if entry.name.startswith('box.') and entry.is_dir():
+                        boxes[entry.name] = self.boxes.get(entry.name)
+            if boxes.keys() != self.boxes.keys():
+                self.boxes = boxes
+                self.modified = True
+            self.mtime = mtime
+        for box_name in self.boxes.keys():
+            box_mtime = os.stat(os.path.join(self.group_name, box_name)).st_mtime_ns
+            if self.boxes[box_name] and self.boxes[box_name]['mtime'] == box_mtime:
+                continue
+            self.boxes[box_name] = self.scan_box(box_name, box_mtime)
+            self.modified = True
+
+    def scan_box(self, box_name, box_mtime):
+        files = []
+        with os.scandir(os.path.join(self.group_name, box_name)) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    files.append(entry.name)
+        files.sort()
+        exec_script = None
+        exec_order = None
+        if 'exec.sh' in files:
+            exec_script = 'exec.sh'
+            exec_order = 0
+        else:
+            for filename in files:
+                if filename.startswith('exec-') and filename.endswith('.sh'):
+                    exec_script = filename
+                    exec_order = int(filename.replace('exec-', '').replace('.sh', ''))
+                    break
+        return {
+            'mtime': box_mtime,
+            'files': files,
+            'exec_script': exec_script,
+            'exec_order': exec_order,
+        }
+
+    def box_names(self, filename=None):
+        if filename is None:
+            return sorted(self.boxes.keys())
+        return sorted(box_name for box_name, box in self.boxes.items() if filename in box['files'])
+
+    def exec_order(self):
+        return {box_name: box['exec_order'] for box_name, box in sorted(self.boxes.items()) if box['exec_script']}
+
+    def read_fragment(self, *path):
+        rel_path = os.path.join(*path)
+        st = os.stat(os.path.join(self.group_name, rel_path))
+        cached = self.fragments.get(rel_path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        text = no_comments(open(os.path.join(self.group_name, rel_path)).read())
+        self.fragments[rel_path] = [st.st_mtime_ns, st.st_size, text, ]
+        self.modified = True
+        return text
+
+    def generate(self, kind):
+        parts = []
+        if os.path.isfile(os.path.join(self.group_name, f'{kind}.header.yml')):
+            parts.append((f'{kind}.header.yml', ))
+        for box_name in self.box_names(f'{kind}.yml'):
+            parts.append((box_name, f'{kind}.yml', ))
+        if os.path.isfile(os.path.join(self.group_name, f'{kind}.footer.yml')):
+            parts.append((f'{kind}.footer.yml', ))
+        signature = []
+        for path in parts:
+            st = os.stat(os.path.join(self.group_name, *path))
+            signature.append([os.path.join(*path), st.st_mtime_ns, st.st_size, ])
+        target = os.path.join(self.group_name, f'docker-compose.{kind}.yml')
+        previous = self.generated.get(target)
+        if previous and previous['signature'] == signature and os.path.isfile(target):
+            if os.stat(target).st_mtime_ns == previous['mtime']:
+                return False
+        yml = []
+        if not parts or len(parts[0]) != 1 or parts[0][0] != f'{kind}.header.yml':
+            yml.append(DEFAULT_HEADER)
+        for path in parts:
+            yml.append(self.read_fragment(*path))
+            if len(path) > 1:
+                yml.append('\n')
+        open(target, 'w').write(''.join(yml))
+        self.generated[target] = {
+            'signature': signature,
+            'mtime': os.stat(target).st_mtime_ns,
+        }
+        self.modified = True
+        return True
+
+
+GROUP_INDEXES = {}
+
+
+def get_group_index(group_name, refresh=True):
+    if group_name not in GROUP_INDEXES:
+        GROUP_INDEXES[group_name] = GroupIndex(group_name)
+        GROUP_INDEXES[group_name].load()
+        refresh = True
+    index = GROUP_INDEXES[group_name]
+    if refresh:
+        index.refresh()
+        index.save()
+    return index
+
+
+def generate_docker_compose_build_file(group_name):
+    index = get_group_index(group_name)
+    if index.generate('build'):
+        print(f'<BOXER> generated [{group_name}/docker-compose.build.yml] file')
+    else:
+        print(f'<BOXER> file [{group_name}/docker-compose.build.yml] is up to date')
+    index.save()
 
 
 def generate_docker_compose_run_file(group_name):
-    yml = ''
-    if os.path.isfile(os.path.join(group_name, 'run.header.yml')):
-        yml += no_comments(open(os.path.join(group_name, 'run.header.yml')).read())
+    index = get_group_index(group_name)
+    if index.generate('run'):
+        print(f'<BOXER> generated [{group_name}/docker-compose.run.yml] file')
     else:
-        yml += """version: '3.1'
+        print(f'<BOXER> file [{group_name}/docker-compose.run.yml] is up to date')
+    index.save()
+
+
+def get_output(name):
+    if not get_settings().quite:
+        return sys.stdout if name == 'stdout' else sys.stderr
+    if name not in OUTPUTS:
+        OUTPUTS[name] = open(f'boxer_{name}.txt', 'w')
+    return OUTPUTS[name]
+
+
+class BoxLog(object):
+    """
+    Streams output of a single process running for one of the "boxes" into the "logs/<box>/<stage>.log" file inside of the group folder.
+    The file is rotated every run and every time it grows bigger than the "log_max_size" setting, the last lines are also kept in memory
+    to be printed when the process fails.
+    """
+
+    def __init__(self, group_name, box_name, stage):
+        self.path = os.path.join(group_name, 'logs', box_name, f'{stage}.log')
+        self.tail = collections.deque(maxlen=LOG_TAIL_LINES)
+        self.size = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.rotate()
+        self.file = open(self.path, 'wb')
+
+    def get_backup_path(self, pos):
+        return f'{self.path[:-len(".log")]}.{pos}.log'
+
+    def rotate(self):
+        if not os.path.isfile(self.path) or os.path.getsize(self.path) == 0:
+            return
+        for pos in range(LOG_BACKUPS, 0, -1):
+            for ext in ('', '.gz', ):
+                if not os.path.isfile(self.get_backup_path(pos) + ext):
+                    continue
+                if pos == LOG_BACKUPS:
+                    os.remove(self.get_backup_path(pos) + ext)
+                else:
+                    os.replace(self.get_backup_path(pos) + ext, self.get_backup_path(pos + 1) + ext)
+        if get_settings().log_compress:
+            with open(self.path, 'rb') as src, gzip.open(self.get_backup_path(1) + '.gz', 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.get_backup_path(1))
+
+    def write(self, text):
+        data = text.encode()
+        if self.size and self.size + len(data) > get_settings().log_max_size:
+            self.file.close()
+            self.rotate()
+            self.file = open(self.path, 'wb')
+            self.size = 0
+        self.file.write(data)
+        self.file.flush()
+        self.size += len(data)
+        self.tail.append(text)
+
+    def close(self):
+        self.file.close()
+
+    def print_tail(self):
+        if not self.tail:
+            return
+        print(f'<BOXER> last {len(self.tail)} lines of [{self.path}]:')
+        for text in self.tail:
+            print('<BOXER>     | ' + text, end='')
 
-services:
 
-"""
-    for box_name in os.listdir(group_name):
-        if not box_name.startswith('box.'):
-            continue
-        if not os.path.isdir(os.path.join(group_name, box_name)):
-            continue
-        if not os.path.isfile(os.path.join(group_name, box_name, 'run.yml')):
+def stop_process(proc, new_session=True):
+    try:
+        if new_session:
+            os.killpg(proc.pid, signal.SIGTERM)
+        else:
+            proc.terminate()
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def read_lines(stream, prefix, target, log=None):
+    def _write(line):
+        text = line.decode(errors='replace')
+        if not text.endswith('\n'):
+            text += '\n'
+        target.write(prefix + text if prefix else text)
+        target.flush()
+        if log:
+            log.write(text)
+
+    pending = b''
+    while True:
+        chunk = await stream.read(64 * 1024)
+        if not chunk:
+            break
+        *lines, pending = (pending + chunk).split(b'\n')
+        for line in lines:
+            _write(line + b'\n')
+    if pending:
+        _write(pending)
+
+
+async def run_process(cmd, cwd=None, prefix=None, timeout=None, inherit=False, log=None):
+    if inherit or (not prefix and not get_settings().quite):
+        proc = await asyncio.create_subprocess_exec(*cmd, cwd=cwd)
+        readers = []
+        new_session = False
+    else:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=cwd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            start_new_session=True,
+        )
+        readers = [
+            read_lines(proc.stdout, prefix, get_output('stdout'), log),
+            read_lines(proc.stderr, prefix, get_output('stderr'), log),
+        ]
+        new_session = True
+    try:
+        await asyncio.wait_for(asyncio.gather(proc.wait(), *readers), timeout)
+    except asyncio.TimeoutError:
+        print(f'<BOXER> process [{" ".join(cmd)}] was stopped after {timeout} seconds timeout')
+        stop_process(proc, new_session)
+        await proc.wait()
+        return 124
+    except BaseException:
+        stop_process(proc, new_session)
+        await proc.wait()
+        raise
+    return proc.returncode
+
+
+async def capture_process(cmd, cwd=None, timeout=None):
+    proc = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=cwd,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError, ):
+        stop_process(proc)
+        await proc.wait()
+        raise
+    return proc.returncode, stdout.decode(errors='replace')
+
+
+def run_command(cmd, cwd=None, prefix=None, timeout=None, inherit=False):
+    try:
+        return asyncio.run(run_process(cmd, cwd=cwd, prefix=prefix, timeout=timeout, inherit=inherit))
+    except FileNotFoundError as e:
+        print(f'<BOXER> {e}')
+        return 127
+
+
+def run_commands(commands):
+    async def _run(cmd, cwd, prefix):
+        try:
+            return await run_process(cmd, cwd=cwd, prefix=prefix)
+        except FileNotFoundError as e:
+            print(f'<BOXER> {e}')
+            return 127
+
+    async def _run_all():
+        return await asyncio.gather(*[_run(cmd, cwd, prefix) for cmd, cwd, prefix in commands])
+
+    return asyncio.run(_run_all())
+
+
+def make_replica_compose_file(src, replica):
+    out = []
+    ports_indent = None
+    for line in src.splitlines(keepends=True):
+        text = line.strip()
+        indent = len(line) - len(line.lstrip())
+        if ports_indent is not None:
+            if text and indent <= ports_indent:
+                ports_indent = None
+            elif text.startswith('-'):
+                port = re.match(r'^(?:(?P<ip>[\d.]+):)?(?P<host>[\d\-]*):(?P<target>[\d\-]+(?:/\w+)?)$', text[1:].strip().strip('"\''))
+                if port:
+                    published = f'{port.group("ip")}::{port.group("target")}' if port.group('ip') else port.group('target')
+                    line = f'{line[:indent]}- "{published}"\n'
+                out.append(line)
+                continue
+        container_name = re.match(r'^(\s*)container_name:\s*["\']?([^"\'\s]+)["\']?\s*$', line)
+        if container_name:
+            line = f'{container_name.group(1)}container_name: {container_name.group(2)}_{replica}\n'
+        elif text == 'ports:':
+            ports_indent = indent
+        out.append(line)
+    return ''.join(out)
+
+
+def get_replica_project(replica):
+    return f'{get_settings().alias}_{replica}'
+
+
+def find_replicas(group_name):
+    replicas = []
+    for filename in os.listdir(group_name):
+        replica = re.match(r'^docker-compose\.run\.(\d+)\.yml$', filename)
+        if replica:
+            replicas.append(int(replica.group(1)))
+    return sorted(replicas)
+
+
+def get_run_targets(group_name, replicas=1):
+    if replicas <= 1:
+        return [(get_settings().alias, 'docker-compose.run.yml', ), ]
+    return [(get_replica_project(replica), f'docker-compose.run.{replica}.yml', ) for replica in range(1, replicas + 1)]
+
+
+def generate_docker_compose_replica_files(group_name, replicas):
+    src = open(os.path.join(group_name, 'docker-compose.run.yml')).read()
+    for replica in range(1, replicas + 1):
+        yml = make_replica_compose_file(src, replica)
+        path = os.path.join(group_name, f'docker-compose.run.{replica}.yml')
+        if os.path.isfile(path) and open(path).read() == yml:
             continue
-        yml += no_comments(open(os.path.join(group_name, box_name, 'run.yml')).read()) + '\n'
-    if os.path.isfile(os.path.join(group_name, 'run.footer.yml')):
-        yml += no_comments(open(os.path.join(group_name, 'run.footer.yml')).read())
-    open(os.path.join(group_name, 'docker-compose.run.yml'), 'w').write(yml)
-    print(f'<BOXER> generated [{group_name}/docker-compose.run.yml] file')
+        open(path, 'w').write(yml)
+        print(f'<BOXER> generated [{path}] file')
+
+
+def read_group_state(group_name):
+    path = os.path.join(group_name, 'group.state.json')
+    if not os.path.isfile(path):
+        return {'projects': {}, }
+    try:
+        return json.loads(open(path).read())
+    except ValueError:
+        return {'projects': {}, }
+
+
+def update_group_state(group_name, last_command=None, project=None, **fields):
+    state = read_group_state(group_name)
+    if last_command:
+        state['last_command'] = last_command
+    if project:
+        state['projects'].setdefault(project, {}).update(fields)
+    state['updated'] = time.time()
+    open(os.path.join(group_name, 'group.state.json'), 'w').write(json.dumps(state, indent=2, sort_keys=True))
 
 
+def hash_file(path):
+    if not os.path.isfile(path):
+        return None
+    return hashlib.sha256(open(path, 'rb').read()).hexdigest()
+
+
+def list_project_containers(group_name, project, compose_file):
+    cmd = ['docker-compose', '-p', project, ]
+    if os.path.isfile(os.path.join(group_name, compose_file)):
+        cmd.extend(['-f', compose_file, ])
+    try:
+        ret, output = asyncio.run(capture_process(cmd + ['ps', '-q', ], cwd=group_name, timeout=60))
+    except (OSError, asyncio.TimeoutError, ):
+        return None
+    if ret != 0:
+        return None
+    return sorted(output.split())
+
+
+def is_project_down(group_name, project, compose_file):
+    if read_group_state(group_name)['projects'].get(project, {}).get('running', True):
+        return False
+    return list_project_containers(group_name, project, compose_file) == []
+
+
+def is_project_up_to_date(group_name, project, compose_file, context_hash):
+    saved = read_group_state(group_name)['projects'].get(project, {})
+    if not saved.get('running') or saved.get('compose_hash') != hash_file(os.path.join(group_name, compose_file)):
+        return False
+    if saved.get('context_hash') != context_hash:
+        return False
+    containers = list_project_containers(group_name, project, compose_file)
+    if not containers or containers != saved.get('containers'):
+        return False
+    ret, output = asyncio.run(capture_process(['docker', 'inspect', '--format', '{{.State.Status}}', ] + containers, timeout=60))
+    return ret == 0 and set(output.split()) == {'running', }
+
+
+def fingerprint_run_context(group_name):
+    h = hashlib.sha256()
+    for box_name in get_group_index(group_name).box_names('run.yml'):
+        if read_service(group_name, box_name, 'run.yml')['build']:
+            h.update(box_name.encode() + b'\0' + fingerprint_box(group_name, box_name).encode())
+    return h.hexdigest()
+
+
+@timed_stage
 def execute_docker_compose_build_down(group_name):
-    print(f'<BOXER> executing [docker-compose -p build{ALIAS} down] in {group_name}/')
-    return os.system(f"/bin/bash -c 'cd {group_name} && docker-compose -p build{ALIAS} down --volumes' {VERBOSE}")
+    alias = get_settings().alias
+    if is_project_down(group_name, f'build{alias}', 'docker-compose.build.yml'):
+        print(f'<BOXER> skipped [docker-compose -p build{alias} down], no containers are running')
+        return 0
+    print(f'<BOXER> executing [docker-compose -p build{alias} down] in {group_name}/')
+    ret = run_command(['docker-compose', '-p', f'build{alias}', 'down', '--volumes', ], cwd=group_name)
+    if ret == 0:
+        update_group_state(group_name, project=f'build{alias}', running=False, containers=[])
+    return ret
 
 
+@timed_stage
 def execute_docker_compose_run_down(group_name):
-    print(f'<BOXER> executing [docker-compose -p {ALIAS} down] in {group_name}/')
-    return os.system(f"/bin/bash -c 'docker-compose -p {ALIAS} down --volumes' {VERBOSE}")
+    alias = get_settings().alias
+    replicas = find_replicas(group_name)
+    if not replicas and is_project_down(group_name, alias, 'docker-compose.run.yml'):
+        print(f'<BOXER> skipped [docker-compose -p {alias} down], no containers are running')
+        return 0
+    print(f'<BOXER> executing [docker-compose -p {alias} down] in {group_name}/')
+    ret = run_command(['docker-compose', '-p', alias, 'down', '--volumes', ])
+    if ret == 0:
+        update_group_state(group_name, project=alias, running=False, containers=[])
+    if ret != 0 or not replicas:
+        return ret
+    commands = []
+    for replica in replicas:
+        project = get_replica_project(replica)
+        print(f'<BOXER> executing [docker-compose -p {project} down] in {group_name}/')
+        commands.append((['docker-compose', '-p', project, '-f', f'docker-compose.run.{replica}.yml', 'down', '--volumes', ], group_name, f'[{project}] ', ))
+    for replica, ret in zip(replicas, run_commands(commands)):
+        if ret != 0:
+            return ret
+        os.remove(os.path.join(group_name, f'docker-compose.run.{replica}.yml'))
+    return 0
+
+
+BUILDX_BUILDER = 'boxer'
 
 
-def execute_docker_compose_build(group_name):
-    print(f'<BOXER> executing [docker-compose -p build{ALIAS} up] in {group_name}/')
-    return os.system(f"/bin/bash -c 'cd {group_name} && docker-compose -p build{ALIAS} -f docker-compose.build.yml up --detach --build {QUITE_PULL}' {VERBOSE}")
+def get_build_cache_dir(box_name):
+    return os.path.abspath(os.path.join(get_cache_dir(), 'buildkit', get_settings().alias, box_name))
 
 
-def execute_docker_compose_run(group_name):
-    print(f'<BOXER> executing [docker-compose -p {ALIAS} up] in {group_name}/')
-    return os.system(f"/bin/bash -c 'cd {group_name} && docker-compose -p {ALIAS} -f docker-compose.run.yml up --build {QUITE_PULL}' {VERBOSE}")
+def get_build_image_tags(service):
+    if service['image']:
+        return [service['image'], ]
+    return [f'build{get_settings().alias}_{service["name"]}', f'build{get_settings().alias}-{service["name"]}', ]
 
 
-def execute_docker_compose_run_exec(group_name, container, command):
-    print(f'<BOXER> executing [docker-compose -p {ALIAS} exec -T {container}] in {group_name}/')
-    cmd = ['docker-compose', '-p', f'{ALIAS}', 'exec', '-T', f'{container}', ]
-    cmd.extend(command)
+async def prepare_buildx_builder():
+    ret, _ = await capture_process(['docker', 'buildx', 'inspect', BUILDX_BUILDER, ])
+    if ret == 0:
+        return 0
+    print(f'<BOXER> creating [{BUILDX_BUILDER}] buildx builder')
+    ret, _ = await capture_process(['docker', 'buildx', 'create', '--name', BUILDX_BUILDER, '--driver', 'docker-container', ])
+    return ret
+
+
+async def build_box_image(group_name, box_name, service):
+    cache_dir = get_build_cache_dir(box_name)
+    os.makedirs(os.path.dirname(cache_dir), exist_ok=True)
+    context = service['build_options'].get('context') or box_name
+    cmd = ['docker', 'buildx', 'build', '--builder', BUILDX_BUILDER, '--load', ]
+    if os.path.isfile(os.path.join(cache_dir, 'index.json')):
+        cmd += ['--cache-from', f'type=local,src={cache_dir}', ]
+    cmd += ['--cache-to', f'type=local,dest={cache_dir}.new,mode=max', ]
+    if service['build_options'].get('dockerfile'):
+        cmd += ['--file', os.path.join(context, service['build_options']['dockerfile']), ]
+    if service['build_options'].get('target'):
+        cmd += ['--target', service['build_options']['target'], ]
+    for tag in get_build_image_tags(service):
+        cmd += ['--tag', tag, ]
+    cmd.append(context)
+    print(f'<BOXER> building image of [{box_name}] with cache in [{cache_dir}]')
+    started = time.monotonic()
+    log = BoxLog(group_name, box_name, 'build')
     try:
-        return subprocess.check_call(cmd)
-    except subprocess.CalledProcessError as e:
-        return e.returncode
+        ret = await run_process(cmd, cwd=group_name, prefix=f'[{box_name}] ', timeout=get_settings().timeout, log=log)
+        if ret != 0:
+            log.print_tail()
+    finally:
+        log.close()
+    if ret == 0 and os.path.isdir(cache_dir + '.new'):
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.rename(cache_dir + '.new', cache_dir)
+    else:
+        shutil.rmtree(cache_dir + '.new', ignore_errors=True)
+    return ret, started, time.monotonic()
+
+
+async def build_box_images(group_name, services):
+    ret = await prepare_buildx_builder()
+    if ret != 0:
+        print(f'<BOXER> failed to prepare [{BUILDX_BUILDER}] buildx builder')
+        return {box_name: (ret, 0.0, ) for box_name in services}
+    ready = time.monotonic()
+    durations = read_timings_history(group_name)['boxes']
+    box_names = sorted(services.keys(), key=lambda box_name: (-durations.get((box_name, 'docker buildx build', ), 0.0), box_name, ))
+    builds = await run_limited([build_box_image(group_name, box_name, services[box_name]) for box_name in box_names])
+    results = {}
+    for box_name, (ret, started, finished) in zip(box_names, builds):
+        record_box_timing(box_name, 'docker buildx build', set(), ready, started, finished, ret)
+        results[box_name] = (ret, finished - started, )
+    return results
+
+
+def execute_build_box_images(group_name, service_names=None, skip=()):
+    services = {}
+    for box_name in list_boxes(group_name):
+        service = read_service(group_name, box_name, 'build.yml')
+        if service['build'] and (not service_names or service['name'] in service_names) and box_name not in skip:
+            services[box_name] = service
+    if not services:
+        return 0
+    results = asyncio.run(build_box_images(group_name, services))
+    print_box_results('docker buildx build', results)
+    for box_name in sorted(results.keys()):
+        if results[box_name][0] != 0:
+            return results[box_name][0]
+    return 0
+
 
+@timed_stage
+def execute_docker_compose_build(group_name, services=None, built=()):
+    alias = get_settings().alias
+    services = services or []
+    build = '--build'
+    if get_settings().build_backend == 'buildx':
+        ret = execute_build_box_images(group_name, services, skip=built)
+        if ret != 0:
+            return ret
+        build = '--no-build'
+    print(f'<BOXER> executing [docker-compose -p build{alias} up{"".join(" " + service_name for service_name in services)}] in {group_name}/')
+    cmd = ['docker-compose', '-p', f'build{alias}', '-f', 'docker-compose.build.yml', 'up', '--detach', build, ]
+    update_group_state(group_name, project=f'build{alias}', running=True)
+    return run_command(cmd + get_settings().quite_pull + services, cwd=group_name)
+
+
+@timed_stage
+def execute_docker_compose_run(group_name, detach=False, replicas=1):
+    alias = get_settings().alias
+    if replicas <= 1:
+        context_hash = fingerprint_run_context(group_name)
+        if detach and not get_settings().force and is_project_up_to_date(group_name, alias, 'docker-compose.run.yml', context_hash):
+            print(f'<BOXER> skipped [docker-compose -p {alias} up], all containers are already running and up to date')
+            return 0
+        saved = read_group_state(group_name)['projects'].get(alias, {})
+        compose_hash = hash_file(os.path.join(group_name, 'docker-compose.run.yml'))
+        build = get_settings().force or saved.get('compose_hash') != compose_hash or saved.get('context_hash') != context_hash
+        print(f'<BOXER> executing [docker-compose -p {alias} up{" --build" if build else ""}{" --detach" if detach else ""}] in {group_name}/')
+        cmd = ['docker-compose', '-p', alias, '-f', 'docker-compose.run.yml', 'up', ]
+        if build:
+            cmd.append('--build')
+        if detach:
+            cmd.append('--detach')
+        update_group_state(group_name, project=alias, running=True, compose_file='docker-compose.run.yml')
+        ret = run_command(cmd + get_settings().quite_pull, cwd=group_name)
+        if ret == 0:
+            update_group_state(
+                group_name,
+                project=alias,
+                compose_hash=compose_hash,
+                context_hash=context_hash,
+                containers=list_project_containers(group_name, alias, 'docker-compose.run.yml') or [],
+            )
+        return ret
+    generate_docker_compose_replica_files(group_name, replicas)
+    commands = []
+    for project, compose_file in get_run_targets(group_name, replicas):
+        print(f'<BOXER> executing [docker-compose -p {project} up --detach] in {group_name}/')
+        commands.append((['docker-compose', '-p', project, '-f', compose_file, 'up', '--build', '--detach', ] + get_settings().quite_pull, group_name, f'[{project}] ', ))
+    for ret in run_commands(commands):
+        if ret != 0:
+            return ret
+    return 0
 
-def execute_docker_exec(group_name):
-    exec_order = []
-    for box_name in os.listdir(group_name):
-        if not box_name.startswith('box.'):
+
+class ShellSession(object):
+    """
+    A long-lived shell running inside of a container via "docker-compose exec -T".
+    Commands are sent to the shell one by one, every command is followed by a unique marker
+    line carrying its exit code, so output and exit code of each command can be told apart.
+    """
+
+    def __init__(self, container):
+        self.container = container
+        self.marker = f'__BOXER_{uuid.uuid4().hex}__'
+        self.proc = None
+
+    async def open(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            'docker-compose', '-p', get_settings().alias, 'exec', '-T', self.container, 'sh',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            start_new_session=True,
+            limit=16 * 1024 * 1024,
+        )
+
+    async def run(self, command):
+        if self.proc is None or self.proc.returncode is not None:
+            await self.open()
+        self.proc.stdin.write(f'( {command}\n) </dev/null 2>&1; printf "\\n{self.marker} %d\\n" "$?"\n'.encode())
+        await self.proc.stdin.drain()
+        lines = []
+        while True:
+            line = await self.proc.stdout.readline()
+            if not line:
+                await self.proc.wait()
+                return 255, ''.join(lines)
+            text = line.decode(errors='replace')
+            if text.startswith(self.marker + ' '):
+                output = ''.join(lines)
+                return int(text[len(self.marker) + 1:].strip()), output[:-1] if output.endswith('\n') else output
+            lines.append(text)
+
+    async def close(self):
+        if self.proc is None or self.proc.returncode is not None:
+            return
+        try:
+            self.proc.stdin.write(b'exit\n')
+            await self.proc.stdin.drain()
+            self.proc.stdin.close()
+            await asyncio.wait_for(self.proc.wait(), 10)
+        except (OSError, asyncio.TimeoutError, ):
+            stop_process(self.proc)
+            await self.proc.wait()
+
+
+def read_batch_commands(path, containers):
+    src = sys.stdin.read() if path == '-' else open(path).read()
+    commands = []
+    for line in src.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
             continue
-        if not os.path.isdir(os.path.join(group_name, box_name)):
+        targets = containers or [None, ]
+        if line.startswith('@'):
+            target, _, line = line[1:].partition(' ')
+            targets = [target, ]
+            line = line.strip()
+        for target in targets:
+            commands.append((target, line, ))
+    return commands
+
+
+async def run_batch_commands(commands):
+    sessions = {}
+    results = []
+    try:
+        for container, command in commands:
+            if container not in sessions:
+                sessions[container] = ShellSession(container)
+            started = time.monotonic()
+            ret, output = await sessions[container].run(command)
+            duration = time.monotonic() - started
+            print(f'<BOXER> [{container}] $ {command}')
+            if output:
+                sys.stdout.write(output if output.endswith('\n') else output + '\n')
+                sys.stdout.flush()
+            print(f'<BOXER> [{container}] exit code {ret} in {duration * 1000.0:.0f}ms')
+            results.append((container, command, ret, duration, ))
+    finally:
+        await asyncio.gather(*[session.close() for session in sessions.values()])
+    return results
+
+
+@timed_stage
+def execute_docker_compose_run_exec_batch(group_name, container, path):
+    commands = read_batch_commands(path, get_exec_containers(container))
+    if not commands:
+        print('<BOXER> no commands to execute')
+        return 0
+    for target, command in commands:
+        if not target:
+            print(f'<BOXER> target container for command [{command}] is unknown, use the "--container" argument or "@container" prefix')
+            return 1
+    print(f'<BOXER> executing {len(commands)} commands in {len(set(target for target, _ in commands))} containers of [{get_settings().alias}]')
+    results = asyncio.run(run_batch_commands(commands))
+    failed = [result for result in results if result[2] != 0]
+    total = sum(result[3] for result in results)
+    print(f'<BOXER> executed {len(results)} commands in {total:.2f}s, {len(failed)} failed')
+    return failed[0][2] if failed else 0
+
+
+def parse_published_port(port):
+    port = port.split('/')[0]
+    parts = port.split(':')
+    if len(parts) < 2 or not parts[-2].isdigit():
+        return None
+    host = parts[0] if len(parts) == 3 and parts[0] not in ('', '0.0.0.0', ) else 'localhost'
+    return host, int(parts[-2])
+
+
+async def probe_service(group_name, box_name, service, project, compose_file):
+    if os.path.isfile(os.path.join(group_name, box_name, 'ready.sh')):
+        ret, _ = await capture_process(['/bin/bash', 'ready.sh', project, ], cwd=os.path.join(group_name, box_name), timeout=30)
+        return ('ready.sh', ret == 0, None, )
+    ret, container_id = await capture_process(['docker-compose', '-p', project, '-f', compose_file, 'ps', '-q', service['name'], ], cwd=group_name, timeout=30)
+    container_id = container_id.strip()
+    if ret != 0 or not container_id:
+        return ('container', False, None, )
+    ret, state = await capture_process(['docker', 'inspect', '--format', '{{.State.Status}} {{if .State.Health}}{{.State.Health.Status}}{{end}}', container_id, ], timeout=30)
+    state = state.split()
+    if ret != 0 or not state:
+        return ('container', False, None, )
+    if state[0] in ('exited', 'dead', ):
+        return ('container', False, f'container is {state[0]}', )
+    if len(state) > 1:
+        return ('healthcheck', state[1] == 'healthy', None, )
+    if project != get_settings().alias:
+        ports = []
+    else:
+        ports = [parse_published_port(port) for port in service['ports']]
+    ports = [port for port in ports if port]
+    if ports:
+        for host, port in ports:
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 5)
+            except (OSError, asyncio.TimeoutError, ):
+                return ('tcp', False, None, )
+            writer.close()
+        return ('tcp', True, None, )
+    return ('container', state[0] == 'running', None, )
+
+
+async def wait_services_ready(group_name, timeout, targets, interval=0.5):
+    started = time.monotonic()
+    results = {}
+
+    async def _wait(box_name, project, compose_file):
+        service = read_service(group_name, box_name, 'run.yml')
+        key = box_name if len(targets) == 1 else f'{box_name}@{project}'
+        label = service['name'] if len(targets) == 1 else f'{service["name"]}@{project}'
+        probe = None
+        while time.monotonic() - started < timeout:
+            try:
+                probe, ready, error = await probe_service(group_name, box_name, service, project, compose_file)
+            except (OSError, asyncio.TimeoutError, ):
+                ready, error = False, None
+            if ready:
+                results[key] = (label, probe, True, time.monotonic() - started, )
+                print(f'<BOXER> service [{label}] is ready after {results[key][3]:.1f}s ({probe})')
+                return
+            if error:
+                results[key] = (label, probe, False, time.monotonic() - started, )
+                print(f'<BOXER> service [{label}] failed: {error}')
+                return
+            await asyncio.sleep(interval)
+        results[key] = (label, probe, False, time.monotonic() - started, )
+
+    box_names = get_group_index(group_name).box_names('run.yml')
+    await asyncio.gather(*[_wait(box_name, project, compose_file) for project, compose_file in targets for box_name in box_names])
+    return results
+
+
+@timed_stage
+def execute_wait_ready(group_name, timeout, replicas=1):
+    print(f'<BOXER> waiting up to {timeout} seconds for all services in {group_name}/ to be ready')
+    started = time.monotonic()
+    results = asyncio.run(wait_services_ready(group_name, timeout, get_run_targets(group_name, replicas)))
+    print('<BOXER> [ready] results:')
+    width = max([len(service_name) for service_name, _, _, _ in results.values()] or [0])
+    for box_name in sorted(results.keys()):
+        service_name, probe, ready, duration = results[box_name]
+        record_box_timing(box_name, probe, set(), started, started, started + duration, 0 if ready else 1)
+        status = 'READY' if ready else 'NOT READY'
+        print(f'<BOXER>     {service_name.ljust(width)}  {status}  {duration:.1f}s  ({probe or "unknown"})')
+    not_ready = sorted(service_name for service_name, _, ready, _ in results.values() if not ready)
+    if not_ready:
+        print(f'<BOXER> services not ready after {timeout} seconds: {", ".join(not_ready)}')
+        return 1
+    return 0
+
+
+def find_run_services(group_name):
+    return [read_service(group_name, box_name, 'run.yml')['name'] for box_name in get_group_index(group_name).box_names('run.yml')]
+
+
+def get_exec_containers(container):
+    if not container:
+        return []
+    if isinstance(container, str):
+        return [name.strip() for name in container.split(',') if name.strip()]
+    return list(container)
+
+
+def get_exec_targets(group_name, containers, replicas=1):
+    """
+    Every container in every copy of the group together with the label of its output and extra "docker-compose exec" arguments.
+    """
+    targets = []
+    for replica, (project, compose_file) in enumerate(get_run_targets(group_name, replicas), start=1):
+        env = [] if replicas <= 1 else ['-e', f'BOXER_REPLICA={replica}', '-e', f'BOXER_REPLICAS={replicas}', ]
+        for container in containers:
+            if replicas <= 1:
+                label = container
+            elif len(containers) == 1:
+                label = project
+            else:
+                label = f'{project}/{container}'
+            targets.append((label, project, compose_file, container, env, ))
+    return targets
+
+
+async def run_exec_targets(group_name, targets, command, gather=False):
+
+    async def _run(label, project, compose_file, container, env):
+        started = time.monotonic()
+        if gather:
+            result = await capture_exec(group_name, project, compose_file, container, command, env, get_settings().timeout)
+            print(f'<BOXER> [{label}] finished with exit code {result.exit_code} in {time.monotonic() - started:.1f}s')
+            for line in (result.stdout + result.stderr).splitlines():
+                print(f'[{label}] {line}')
+            return result.exit_code, time.monotonic() - started
+        cmd = ['docker-compose', '-p', project, '-f', compose_file, 'exec', '-T', *env, container, *command, ]
+        try:
+            ret = await run_process(cmd, cwd=group_name, prefix=f'[{label}] ', timeout=get_settings().timeout)
+        except FileNotFoundError as e:
+            print(f'<BOXER> {e}')
+            ret = 127
+        return ret, time.monotonic() - started
+
+    results = await run_limited([_run(*target) for target in targets])
+    return {target[0]: result for target, result in zip(targets, results)}
+
+
+@timed_stage
+def execute_docker_compose_run_exec(group_name, container, command, replicas=1, gather=False):
+    containers = get_exec_containers(container)
+    if not containers:
+        print('<BOXER> no target containers to execute the command in')
+        return 1
+    if replicas <= 1 and len(containers) == 1 and not gather:
+        print(f'<BOXER> executing [docker-compose -p {get_settings().alias} exec -T {containers[0]}] in {group_name}/')
+        cmd = ['docker-compose', '-p', f'{get_settings().alias}', 'exec', '-T', f'{containers[0]}', ]
+        cmd.extend(command)
+        return run_command(cmd, inherit=True)
+    targets = get_exec_targets(group_name, containers, replicas)
+    print(f'<BOXER> executing [{" ".join(command)}] in {len(targets)} containers of {group_name}/, up to {max(1, get_settings().jobs)} at the same time')
+    started = time.monotonic()
+    results = asyncio.run(run_exec_targets(group_name, targets, command, gather=gather))
+    print_box_results(f'exec in {time.monotonic() - started:.1f}s', results)
+    for label, _, _, _, _ in targets:
+        if results[label][0] != 0:
+            return results[label][0]
+    return 0
+
+
+def parse_service_fragment(src):
+    service = {
+        'name': None,
+        'container_name': None,
+        'image': None,
+        'build': False,
+        'build_options': {},
+        'depends_on': [],
+        'ports': [],
+    }
+    service_indent = None
+    key_indent = None
+    item_indent = None
+    key = None
+    for line in src.splitlines():
+        if not line.strip():
             continue
-        if os.path.isfile(os.path.join(group_name, box_name, 'exec.sh')):
-            exec_order.append((0, box_name, ))
+        indent = len(line) - len(line.lstrip())
+        text = line.strip()
+        if service_indent is None:
+            if text.endswith(':'):
+                service_indent = indent
+                service['name'] = text[:-1].strip()
             continue
-        for filename in os.listdir(os.path.join(group_name, box_name)):
-            if filename.startswith('exec-') and filename.endswith('.sh'):
-                exec_order.append((int(filename.replace('exec-', '').replace('.sh', '')), box_name, ))
-                break
-    exec_order.sort(key=lambda item: item[0])
-    for order_position, box_name in exec_order:
-        filename = 'exec.sh' if order_position == 0 else 'exec-{}.sh'.format(order_position)
-        print(f'<BOXER> executing [{filename}] in {group_name}/{box_name}/')
-        cd_path = os.path.join(group_name, box_name)
-        ret = os.system(f"/bin/bash -c 'cd {cd_path} && /bin/bash {filename}' {VERBOSE}")
+        if indent <= service_indent:
+            break
+        if key_indent is None:
+            key_indent = indent
+        if indent == key_indent:
+            key, _, value = text.partition(':')
+            key = key.strip()
+            value = value.strip().strip('"\'')
+            item_indent = None
+            if key in ('container_name', 'image', ) and value:
+                service[key] = value
+            elif key == 'build':
+                service['build'] = True
+                if value:
+                    service['build_options']['context'] = value
+            continue
+        if key not in ('build', 'depends_on', 'ports', ):
+            continue
+        if item_indent is None:
+            item_indent = indent
+        if indent != item_indent:
+            continue
+        if key == 'build':
+            option, _, value = text.partition(':')
+            if option.strip() in ('context', 'dockerfile', 'target', ) and value.strip():
+                service['build_options'][option.strip()] = value.strip().strip('"\'')
+        elif text.startswith('-'):
+            service[key].append(text[1:].strip().strip('"\''))
+        elif text.endswith(':'):
+            service[key].append(text[:-1].strip().strip('"\''))
+    return service
+
+
+def read_service(group_name, box_name, filename):
+    index = get_group_index(group_name, refresh=False)
+    if box_name not in index.box_names(filename):
+        service = parse_service_fragment('')
+    else:
+        service = parse_service_fragment(index.read_fragment(box_name, filename))
+    if not service['name']:
+        service['name'] = box_name.replace('box.', '', 1)
+    return service
+
+
+def read_build_yml_service(group_name, box_name):
+    service = read_service(group_name, box_name, 'build.yml')
+    return service['name'], service['depends_on']
+
+
+def find_box_scripts(group_name, filename):
+    return {box_name: filename for box_name in get_group_index(group_name).box_names(filename)}
+
+
+def find_exec_scripts(group_name):
+    return get_group_index(group_name).exec_order()
+
+
+def get_exec_filename(order_position):
+    return 'exec.sh' if order_position == 0 else f'exec-{order_position}.sh'
+
+
+def build_exec_dependencies(group_name, exec_order):
+    services = {}
+    depends_on = {}
+    for box_name in exec_order:
+        service_name, depends_on[box_name] = read_build_yml_service(group_name, box_name)
+        services[service_name] = box_name
+    dependencies = {}
+    for box_name, order_position in exec_order.items():
+        required = set()
+        for other_box_name, other_order_position in exec_order.items():
+            if other_order_position < order_position:
+                required.add(other_box_name)
+        for service_name in depends_on[box_name]:
+            other_box_name = services.get(service_name, box_name)
+            if other_box_name != box_name and exec_order[other_box_name] <= order_position:
+                required.add(other_box_name)
+        dependencies[box_name] = required
+    return dependencies
+
+
+def build_exec_dependents(group_name, box_names, exec_dependencies):
+    """
+    For every box the exec scripts which may change its container: scripts of boxes which depend on it
+    through "depends_on" or a higher "exec-N" number, also transitively, so "commit.sh" of the box must wait for them.
+    """
+    services = {}
+    depends_on = {}
+    for box_name in box_names:
+        service_name, depends_on[box_name] = read_build_yml_service(group_name, box_name)
+        services[service_name] = box_name
+    direct = {}
+    for box_name in box_names:
+        direct[box_name] = set(exec_dependencies.get(box_name, set()))
+        direct[box_name].update(services[service_name] for service_name in depends_on[box_name] if services.get(service_name, box_name) != box_name)
+    dependents = collections.defaultdict(set)
+    for box_name in exec_dependencies:
+        queue = list(direct[box_name])
+        while queue:
+            other_box_name = queue.pop()
+            if other_box_name == box_name or box_name in dependents[other_box_name]:
+                continue
+            dependents[other_box_name].add(box_name)
+            queue.extend(direct.get(other_box_name, set()))
+    return dependents
+
+
+def print_box_results(title, results):
+    print(f'<BOXER> [{title}] results:')
+    width = max(len(box_name) for box_name in results)
+    for box_name in sorted(results.keys()):
+        ret, duration = results[box_name]
+        if ret is None:
+            status = 'SKIPPED'
+        elif ret == 0:
+            status = 'OK'
+        elif ret < 0:
+            status = f'KILLED by signal {-ret}'
+        else:
+            status = f'FAILED with exit code {ret}'
+        print(f'<BOXER>     {box_name.ljust(width)}  {status}  {duration:.1f}s')
+
+
+async def run_box_script(group_name, box_name, filename):
+    print(f'<BOXER> executing [{filename}] in {group_name}/{box_name}/')
+    log = BoxLog(group_name, box_name, filename)
+    try:
+        ret = await run_process(
+            ['/bin/bash', filename, ],
+            cwd=os.path.join(group_name, box_name),
+            prefix=f'[{box_name}] ',
+            timeout=get_settings().timeout,
+            log=log,
+        )
         if ret != 0:
-            return ret
+            log.print_tail()
+    except OSError as e:
+        print(f'<BOXER> [{filename}] in {group_name}/{box_name}/ failed to start: {e}')
+        ret = 127
+    finally:
+        log.close()
+    return ret
+
+
+async def run_box_jobs(group_name, jobs, dependencies):
+    results = {}
+    failures = []
+    limit = max(1, get_settings().jobs)
+    ranks = rank_box_jobs(jobs, dependencies, estimate_box_jobs(jobs, read_timings_history(group_name)['boxes']))
+    ready = {}
+
+    async def _run(job_name):
+        label, func = jobs[job_name]
+        ret = None
+        started = time.monotonic()
+        try:
+            ret = await func()
+        except asyncio.CancelledError:
+            ret = -signal.SIGTERM
+        except Exception as e:
+            print(f'<BOXER> [{label}] failed in [{job_name}]: {e!r}')
+            ret = 1
+        finally:
+            finished = time.monotonic()
+            results[job_name] = (ret, finished - started, )
+            record_box_timing(job_name, label, dependencies.get(job_name, set()), ready[job_name], started, finished, ret)
+
+    pending = sorted(jobs.keys())
+    finished = set()
+    tasks = {}
+    while pending or tasks:
+        if not failures:
+            for job_name in pending:
+                if job_name not in ready and (dependencies.get(job_name, set()) & set(jobs.keys())) <= finished:
+                    ready[job_name] = time.monotonic()
+            for job_name in sorted(ready.keys() & set(pending), key=lambda name: (-ranks[name], name, ))[:limit - len(tasks)]:
+                pending.remove(job_name)
+                tasks[asyncio.ensure_future(_run(job_name))] = job_name
+        if not tasks:
+            break
+        done, _ = await asyncio.wait(tasks.keys(), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            job_name = tasks.pop(task)
+            if results[job_name][0] == 0:
+                finished.add(job_name)
+            elif not failures:
+                failures.append(job_name)
+                print(f'<BOXER> [{jobs[job_name][0]}] failed in [{job_name}], stopping other running scripts')
+                for other_task in tasks.keys():
+                    other_task.cancel()
+    for job_name in pending:
+        results[job_name] = (None, 0.0, )
+        record_box_timing(job_name, jobs[job_name][0], dependencies.get(job_name, set()), ready.get(job_name, time.monotonic()), None, None, None)
+    return results, failures, pending
+
+
+async def run_box_scripts(group_name, scripts, title, dependencies):
+    jobs = {}
+    for box_name, filename in scripts.items():
+        jobs[box_name] = (filename, functools.partial(run_box_script, group_name, box_name, filename), )
+    return await run_box_jobs(group_name, jobs, dependencies)
+
+
+def execute_box_scripts(group_name, scripts, title, dependencies=None, results=None):
+    if not scripts:
+        return 0
+    box_results, failures, pending = asyncio.run(run_box_scripts(group_name, scripts, title, dependencies or {}))
+    print_box_results(title, box_results)
+    if results is not None:
+        results.update(box_results)
+    if failures:
+        return box_results[failures[0]][0]
+    if pending:
+        print(f'<BOXER> [{title}] circular dependency detected between: {", ".join(pending)}')
+        return 1
     return 0
 
 
-def execute_checkout(group_name):
-    for box_name in os.listdir(group_name):
-        if not box_name.startswith('box.'):
+@timed_stage
+def execute_docker_exec(group_name, box_names=None):
+    exec_order = find_exec_scripts(group_name)
+    if box_names is not None:
+        exec_order = {box_name: order_position for box_name, order_position in exec_order.items() if box_name in box_names}
+    scripts = {box_name: get_exec_filename(order_position) for box_name, order_position in exec_order.items()}
+    return execute_box_scripts(group_name, scripts, 'exec.sh', build_exec_dependencies(group_name, exec_order))
+
+
+def get_cache_dir():
+    return get_settings().cache_dir or os.environ.get('BOXER_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'boxer')
+
+
+def read_checkout_yml(group_name, box_name):
+    checkout = {
+        'repo': None,
+        'ref': 'HEAD',
+        'subpath': '',
+        'target': 'app',
+    }
+    for line in get_group_index(group_name, refresh=False).read_fragment(box_name, 'checkout.yml').splitlines():
+        key, _, value = line.partition(':')
+        key = key.strip()
+        value = value.strip().strip('"\'')
+        if key in checkout and value:
+            checkout[key] = value
+    checkout['subpath'] = checkout['subpath'].strip('/')
+    checkout['target'] = checkout['target'].strip('/')
+    if checkout['repo'] and not re.match(r'^[a-z][a-z0-9+.\-]*://', checkout['repo']) and '@' not in checkout['repo']:
+        checkout['repo'] = os.path.abspath(os.path.join(group_name, box_name, checkout['repo']))
+    return checkout
+
+
+async def git(*args, cwd=None):
+    return await capture_process(['git', ] + list(args), cwd=cwd)
+
+
+async def lock_file(path):
+    fd = os.open(path, os.O_CREAT | os.O_RDWR)
+    await asyncio.get_event_loop().run_in_executor(None, fcntl.flock, fd, fcntl.LOCK_EX)
+    return fd
+
+
+def unlock_file(fd):
+    fcntl.flock(fd, fcntl.LOCK_UN)
+    os.close(fd)
+
+
+async def resolve_mirror_ref(mirror, ref):
+    for candidate in (ref, f'refs/heads/{ref}', f'refs/tags/{ref}', ):
+        ret, sha = await git('--git-dir', mirror, 'rev-parse', '--verify', '--quiet', f'{candidate}^{{commit}}')
+        if ret == 0 and sha.strip():
+            return sha.strip()
+    return None
+
+
+async def update_mirror(repo, refs):
+    mirrors_dir = os.path.join(get_cache_dir(), 'mirrors')
+    os.makedirs(mirrors_dir, exist_ok=True)
+    mirror = os.path.join(mirrors_dir, hashlib.sha1(repo.encode()).hexdigest() + '.git')
+    fd = await lock_file(mirror + '.lock')
+    try:
+        if not os.path.isdir(mirror):
+            print(f'<BOXER> cloning [{repo}] into the shared cache')
+            ret, _ = await git('clone', '--mirror', '--quiet', repo, mirror)
+            if ret != 0:
+                return None, {}
+        else:
+            ret, remote_refs = await git('ls-remote', repo)
+            remote = {}
+            for line in remote_refs.splitlines():
+                sha, _, name = line.partition('\t')
+                remote[name] = sha
+            outdated = ret != 0
+            for ref in refs:
+                if ret != 0:
+                    break
+                current = await resolve_mirror_ref(mirror, ref)
+                if re.match(r'^[0-9a-f]{7,40}$', ref):
+                    outdated = outdated or current is None
+                    continue
+                latest = None
+                for name in (ref, f'refs/heads/{ref}', f'refs/tags/{ref}^{{}}', f'refs/tags/{ref}', ):
+                    if name in remote:
+                        latest = remote[name]
+                        break
+                outdated = outdated or current is None or latest != current
+            if outdated:
+                print(f'<BOXER> fetching [{repo}] into the shared cache')
+                ret, _ = await git('--git-dir', mirror, 'fetch', '--prune', '--quiet', 'origin')
+                if ret != 0:
+                    print(f'<BOXER> failed to fetch [{repo}], using the cached copy')
+        shas = {}
+        for ref in refs:
+            shas[ref] = await resolve_mirror_ref(mirror, ref)
+    finally:
+        unlock_file(fd)
+    return mirror, shas
+
+
+async def extract_tree(mirror, sha):
+    trees_dir = os.path.join(get_cache_dir(), 'trees')
+    os.makedirs(trees_dir, exist_ok=True)
+    tree = os.path.join(trees_dir, sha)
+    if os.path.isdir(tree):
+        return tree
+    tmp = f'{tree}.tmp-{os.getpid()}'
+    os.makedirs(tmp, exist_ok=True)
+    read_fd, write_fd = os.pipe()
+    try:
+        archive = await asyncio.create_subprocess_exec('git', '--git-dir', mirror, 'archive', '--format=tar', sha, stdout=write_fd)
+        tar = await asyncio.create_subprocess_exec('tar', '-x', '-C', tmp, stdin=read_fd)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+    if await archive.wait() != 0 or await tar.wait() != 0:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return None
+    try:
+        os.rename(tmp, tree)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return tree
+
+
+def link_tree(source, target):
+    for root, dirs, files in os.walk(source):
+        rel_root = os.path.relpath(root, source)
+        os.makedirs(os.path.join(target, rel_root), exist_ok=True)
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dst = os.path.join(target, rel_root, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif os.path.isfile(src):
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+
+
+def place_tree(tree, subpath, target, marker):
+    source = os.path.join(tree, subpath) if subpath else tree
+    if not os.path.isdir(source):
+        return f'folder [{subpath}] was not found'
+    if os.path.exists(target) and not os.path.isfile(os.path.join(target, '.boxer-checkout')):
+        return f'folder [{target}] already exists and was not created by BOXER'
+    tmp = target + '.boxer-tmp'
+    shutil.rmtree(tmp, ignore_errors=True)
+    link_tree(source, tmp)
+    open(os.path.join(tmp, '.boxer-checkout'), 'w').write(marker)
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.rename(tmp, target)
+    return None
+
+
+async def run_declarative_checkouts(group_name, checkouts):
+    results = {}
+    semaphore = asyncio.Semaphore(max(1, get_settings().jobs))
+    repos = {}
+    for box_name, checkout in checkouts.items():
+        repos.setdefault(checkout['repo'], set()).add(checkout['ref'])
+
+    async def _update(repo):
+        async with semaphore:
+            return await update_mirror(repo, sorted(repos[repo]))
+
+    mirrors = dict(zip(repos.keys(), await asyncio.gather(*[_update(repo) for repo in repos])))
+    trees = {}
+    for box_name, checkout in sorted(checkouts.items()):
+        started = time.monotonic()
+        mirror, shas = mirrors[checkout['repo']]
+        sha = shas.get(checkout['ref'])
+        if not mirror or not sha:
+            print(f'<BOXER> [{box_name}] failed to resolve [{checkout["ref"]}] in [{checkout["repo"]}]')
+            results[box_name] = (1, time.monotonic() - started, )
             continue
-        if not os.path.isdir(os.path.join(group_name, box_name)):
+        target = os.path.join(group_name, box_name, checkout['target'])
+        marker = f'{checkout["repo"]}\n{sha}\n{checkout["subpath"]}\n'
+        if os.path.isfile(os.path.join(target, '.boxer-checkout')) and open(os.path.join(target, '.boxer-checkout')).read() == marker:
+            print(f'<BOXER> [{box_name}] [{checkout["target"]}] is already at {sha[:12]}')
+            results[box_name] = (0, time.monotonic() - started, )
+            continue
+        if sha not in trees:
+            trees[sha] = await extract_tree(mirror, sha)
+        if not trees[sha]:
+            print(f'<BOXER> [{box_name}] failed to extract {sha[:12]} from [{checkout["repo"]}]')
+            results[box_name] = (1, time.monotonic() - started, )
             continue
-        if not os.path.isfile(os.path.join(group_name, box_name, 'checkout.sh')):
+        error = await asyncio.get_event_loop().run_in_executor(None, place_tree, trees[sha], checkout['subpath'], target, marker)
+        if error:
+            print(f'<BOXER> [{box_name}] {error}')
+            results[box_name] = (1, time.monotonic() - started, )
             continue
-        print(f'<BOXER> executing [checkout.sh] in {group_name}/{box_name}/')
-        cd_path = os.path.join(group_name, box_name)
-        ret = os.system(f"/bin/bash -c 'cd {cd_path} && /bin/bash checkout.sh' {VERBOSE}")
+        print(f'<BOXER> [{box_name}] [{checkout["target"]}] was placed at {sha[:12]}')
+        results[box_name] = (0, time.monotonic() - started, )
+    return results
+
+
+def execute_declarative_checkout(group_name):
+    checkouts = {}
+    for box_name in get_group_index(group_name).box_names('checkout.yml'):
+        checkout = read_checkout_yml(group_name, box_name)
+        if not checkout['repo']:
+            print(f'<BOXER> [{box_name}] "repo" field is missing in checkout.yml file')
+            return 1
+        checkouts[box_name] = checkout
+    if not checkouts:
+        return 0
+    results = asyncio.run(run_declarative_checkouts(group_name, checkouts))
+    print_box_results('checkout.yml', results)
+    for box_name in sorted(results.keys()):
+        if results[box_name][0] != 0:
+            return results[box_name][0]
+    return 0
+
+
+@timed_stage
+def execute_checkout(group_name):
+    ret = execute_declarative_checkout(group_name)
+    if ret != 0:
+        return ret
+    return execute_box_scripts(group_name, find_box_scripts(group_name, 'checkout.sh'), 'checkout.sh')
+
+
+@timed_stage
+def execute_docker_commit(group_name, box_names=None):
+    scripts = find_box_scripts(group_name, 'commit.sh')
+    if box_names is not None:
+        scripts = {box_name: filename for box_name, filename in scripts.items() if box_name in box_names}
+    return execute_box_scripts(group_name, scripts, 'commit.sh')
+
+
+@timed_stage
+def execute_docker_push(group_name, box_names=None):
+    scripts = find_box_scripts(group_name, 'push.sh')
+    if box_names is not None:
+        scripts = {box_name: filename for box_name, filename in scripts.items() if box_name in box_names}
+    manifest = read_push_manifest(group_name)
+    images = {}
+    skipped = [box_name for box_name in sorted(scripts.keys()) if not is_push_required(group_name, box_name, manifest, images)]
+    for box_name in skipped:
+        scripts.pop(box_name)
+    print_push_savings(manifest, images, skipped)
+    results = {}
+    ret = execute_box_scripts(group_name, scripts, 'push.sh', results=results)
+    write_push_manifest(group_name, {box_name: (images.get(box_name), ) + results[box_name] for box_name in results})
+    return ret
+
+
+def make_checkout_build_graph(group_name):
+    checkouts = find_box_scripts(group_name, 'checkout.sh')
+    steps = {}
+    dependencies = {}
+    for box_name in list_boxes(group_name):
+        if box_name in checkouts:
+            steps[f'{box_name}/checkout.sh'] = (box_name, 'checkout.sh', )
+            dependencies[f'{box_name}/build'] = {f'{box_name}/checkout.sh', }
+        steps[f'{box_name}/build'] = (box_name, 'docker buildx build', )
+    return steps, dependencies
+
+
+@timed_stage
+def execute_checkout_build_pipeline(group_name, fingerprints, changed, built):
+    manifest = read_build_manifest(group_name)
+
+    def _check(box_name):
+        fingerprints[box_name] = fingerprint_box(group_name, box_name)
+        return get_settings().force or is_box_changed(group_name, box_name, fingerprints[box_name], manifest)
+
+    async def _build(box_name):
+        if not await asyncio.get_event_loop().run_in_executor(None, contextvars.copy_context().run, _check, box_name):
+            return 0
+        changed.append(box_name)
+        service = read_service(group_name, box_name, 'build.yml')
+        if not service['build']:
+            return 0
+        ret, _, _ = await build_box_image(group_name, box_name, service)
+        if ret == 0:
+            built.append(box_name)
+        return ret
+
+    steps, dependencies = make_checkout_build_graph(group_name)
+    jobs = {}
+    for job_name, (box_name, label) in steps.items():
+        if label == 'checkout.sh':
+            jobs[job_name] = (label, functools.partial(run_box_script, group_name, box_name, label), )
+        else:
+            jobs[job_name] = (label, functools.partial(_build, box_name), )
+
+    async def _run():
+        ret = await prepare_buildx_builder()
         if ret != 0:
+            print(f'<BOXER> failed to prepare [{BUILDX_BUILDER}] buildx builder')
             return ret
+        results, failures, _ = await run_box_jobs(group_name, jobs, dependencies)
+        print_box_results('checkout.sh > docker buildx build', results)
+        return results[failures[0]][0] if failures else 0
+
+    ret = asyncio.run(_run())
+    changed.sort()
+    return ret
+
+
+def make_box_pipeline_graph(group_name, required, changed, push=True):
+    exec_order = {box_name: order_position for box_name, order_position in find_exec_scripts(group_name).items() if box_name in required}
+    exec_dependencies = build_exec_dependencies(group_name, exec_order)
+    commits = find_box_scripts(group_name, 'commit.sh')
+    pushes = find_box_scripts(group_name, 'push.sh') if push else {}
+    steps = {}
+    dependencies = {}
+    stages = {}
+    for box_name, order_position in exec_order.items():
+        filename = get_exec_filename(order_position)
+        stages[box_name] = [f'{box_name}/{filename}', ]
+        steps[stages[box_name][-1]] = (box_name, filename, )
+    for box_name in changed:
+        for filename, scripts in (('commit.sh', commits, ), ('push.sh', pushes, ), ):
+            if box_name in scripts:
+                stages.setdefault(box_name, []).append(f'{box_name}/{filename}')
+                steps[stages[box_name][-1]] = (box_name, filename, )
+    for box_name, job_names in stages.items():
+        for previous, job_name in zip(job_names, job_names[1:]):
+            dependencies[job_name] = {previous, }
+    for box_name, required_boxes in exec_dependencies.items():
+        dependencies[stages[box_name][0]] = {stages[other_box_name][0] for other_box_name in required_boxes}
+    for box_name, exec_box_names in build_exec_dependents(group_name, sorted(required), exec_dependencies).items():
+        if f'{box_name}/commit.sh' in steps:
+            dependencies.setdefault(f'{box_name}/commit.sh', set()).update(stages[other_box_name][0] for other_box_name in exec_box_names)
+    return steps, dependencies
+
+
+@timed_stage
+def execute_box_pipeline(group_name, required, changed, push=True):
+    steps, dependencies = make_box_pipeline_graph(group_name, required, changed, push=push)
+    pushes = [box_name for box_name, label in steps.values() if label == 'push.sh']
+    manifest = read_push_manifest(group_name)
+    images = {}
+    skipped = []
+
+    async def _push(box_name):
+        if not is_push_required(group_name, box_name, manifest, images):
+            skipped.append(box_name)
+            return 0
+        return await run_box_script(group_name, box_name, 'push.sh')
+
+    jobs = {}
+    for job_name, (box_name, label) in steps.items():
+        if label == 'push.sh':
+            jobs[job_name] = (label, functools.partial(_push, box_name), )
+        else:
+            jobs[job_name] = (label, functools.partial(run_box_script, group_name, box_name, label), )
+    if not jobs:
+        return 0
+    results, failures, pending = asyncio.run(run_box_jobs(group_name, jobs, dependencies))
+    print_box_results('exec.sh > commit.sh > push.sh', results)
+    print_push_savings(manifest, images, skipped)
+    write_push_manifest(group_name, {box_name: (images.get(box_name), ) + results[f'{box_name}/push.sh'] for box_name in pushes if box_name not in skipped})
+    if failures:
+        return results[failures[0]][0]
+    if pending:
+        print(f'<BOXER> [exec.sh] circular dependency detected between: {", ".join(pending)}')
+        return 1
     return 0
 
 
-def execute_docker_commit(group_name):
-    for box_name in os.listdir(group_name):
-        if not box_name.startswith('box.'):
+def simulate_box_jobs(jobs, dependencies, estimates):
+    ranks = rank_box_jobs(jobs, dependencies, estimates)
+    limit = max(1, get_settings().jobs)
+    started = {}
+    finished = {}
+    running = []
+    clock = 0.0
+    pending = set(jobs.keys())
+    while pending or running:
+        ready = [job_name for job_name in pending if (dependencies.get(job_name, set()) & set(jobs.keys())) <= finished.keys()]
+        for job_name in sorted(ready, key=lambda name: (-ranks[name], name, ))[:limit - len(running)]:
+            pending.remove(job_name)
+            started[job_name] = clock
+            heapq.heappush(running, (clock + estimates[job_name], job_name, ))
+        if not running:
+            break
+        clock, job_name = heapq.heappop(running)
+        finished[job_name] = clock
+    return started, finished
+
+
+def make_plan_stages(group_name, command):
+    """
+    Steps of the command in the same order as they are executed, every step with "box" jobs comes together with their dependencies.
+    The "build" command is planned as if all of the "boxes" were changed.
+    """
+    if command == 'start':
+        return [('docker_compose_run', None, ), ('wait_ready', None, ), ]
+    box_names = list_boxes(group_name)
+    stages = [('docker_compose_build_down', None, ), ]
+    if get_settings().pipeline and get_settings().build_backend == 'buildx':
+        stages.append(('checkout_build_pipeline', make_checkout_build_graph(group_name), ))
+    else:
+        stages.append(('checkout', ({box_name: (box_name, filename, ) for box_name, filename in find_box_scripts(group_name, 'checkout.sh').items()}, {}, ), ))
+    stages.append(('docker_compose_build', None, ))
+    if get_settings().pipeline:
+        stages.append(('box_pipeline', make_box_pipeline_graph(group_name, box_names, box_names), ))
+    else:
+        exec_order = find_exec_scripts(group_name)
+        stages.append(('docker_exec', ({box_name: (box_name, get_exec_filename(order_position), ) for box_name, order_position in exec_order.items()}, build_exec_dependencies(group_name, exec_order), ), ))
+        for stage_name, filename in (('docker_commit', 'commit.sh', ), ('docker_push', 'push.sh', ), ):
+            stages.append((stage_name, ({box_name: (box_name, filename, ) for box_name in find_box_scripts(group_name, filename)}, {}, ), ))
+    stages.append(('docker_compose_build_down', None, ))
+    return stages
+
+
+def execute_plan(group_name, command='build'):
+    history = read_timings_history(group_name)
+    plan = {
+        'group': group_name,
+        'command': command,
+        'jobs': max(1, get_settings().jobs),
+        'wall_time': 0.0,
+        'unknown': 0,
+        'stages': [],
+        'critical_path': [],
+    }
+    for stage_name, graph in make_plan_stages(group_name, command):
+        stage = {
+            'name': stage_name,
+            'started': plan['wall_time'],
+            'wall_time': history['stages'].get((command, stage_name, )),
+            'boxes': {},
+        }
+        if graph is None:
+            if stage['wall_time'] is None:
+                plan['unknown'] += 1
+        else:
+            steps, dependencies = graph
+            jobs = {job_name: (label, None, ) for job_name, (_, label) in steps.items()}
+            estimates = estimate_box_jobs(jobs, history['boxes'])
+            started, finished = simulate_box_jobs(jobs, dependencies, estimates)
+            for job_name in sorted(jobs.keys()):
+                if (steps[job_name][0], jobs[job_name][0], ) not in history['boxes']:
+                    plan['unknown'] += 1
+                stage['boxes'][job_name] = {
+                    'script': jobs[job_name][0],
+                    'started': started.get(job_name),
+                    'finished': finished.get(job_name),
+                    'dependencies': sorted(dependencies.get(job_name, set()) & set(jobs.keys())),
+                    'expected': estimates[job_name],
+                }
+            stage['wall_time'] = max(finished.values(), default=0.0)
+        plan['wall_time'] += stage['wall_time'] or 0.0
+        plan['stages'].append(stage)
+        plan['critical_path'].append({
+            'stage': stage_name,
+            'wall_time': stage['wall_time'],
+            'boxes': find_critical_path(stage),
+        })
+    print_plan(plan)
+    return plan
+
+
+def print_plan(plan):
+
+    def _seconds(value):
+        return '?' if value is None else f'{value:.1f}s'
+
+    print(f'<BOXER> plan of [{plan["command"]}] in {plan["group"]}/ with up to {plan["jobs"]} scripts running at the same time')
+    print('<BOXER>     {:<32} {:>9} {:>9}'.format('stage / box', 'start', 'expected'))
+    for stage in plan['stages']:
+        print('<BOXER>     {:<32} {:>9} {:>9}'.format(stage['name'], _seconds(stage['started']), _seconds(stage['wall_time'])))
+        for box_name, box in stage['boxes'].items():
+            print('<BOXER>       {:<30} {:>9} {:>9}'.format(box_name, _seconds(box['started']), _seconds(box['expected'])))
+    critical_path = []
+    for item in plan['critical_path']:
+        if item['boxes']:
+            critical_path.append('{}({})'.format(item['stage'], ' > '.join(item['boxes'])))
+        else:
+            critical_path.append(item['stage'])
+    print(f'<BOXER>     critical path: {" -> ".join(critical_path)}')
+    print('<BOXER>     estimated total: {:.1f}s'.format(plan['wall_time']))
+    if plan['unknown']:
+        print(f'<BOXER>     {plan["unknown"]} steps were never executed successfully before, their time is taken from the same script of other boxes or not counted')
+
+
+def list_boxes(group_name):
+    return get_group_index(group_name).box_names('build.yml')
+
+
+BOX_CONFIG_FILES = ('Dockerfile', '.dockerignore', '*.yml', '*.sh', '*.env', )
+
+
+def read_dockerignore(box_dir):
+    patterns = []
+    if not os.path.isfile(os.path.join(box_dir, '.dockerignore')):
+        return patterns
+    for line in open(os.path.join(box_dir, '.dockerignore')).read().splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
             continue
-        if not os.path.isdir(os.path.join(group_name, box_name)):
+        negate = line.startswith('!')
+        line = os.path.normpath(line.lstrip('!').strip().strip('/'))
+        patterns.append((line, negate, ))
+    return patterns
+
+
+def is_box_config_file(filename):
+    return any(fnmatch.fnmatch(filename, pattern) for pattern in BOX_CONFIG_FILES)
+
+
+def match_dockerignore_pattern(rel_path, pattern):
+    parts = rel_path.split(os.sep)
+    for i in range(1, len(parts) + 1):
+        if fnmatch.fnmatch('/'.join(parts[:i]), pattern) or fnmatch.fnmatch(parts[i - 1], pattern):
+            return True
+    return False
+
+
+def is_ignored(rel_path, patterns):
+    ignored = False
+    for pattern, negate in patterns:
+        if match_dockerignore_pattern(rel_path, pattern):
+            ignored = not negate
+    return ignored
+
+
+def has_dockerignore_exceptions(rel_path, patterns):
+    return any(negate and pattern.startswith(rel_path + '/') for pattern, negate in patterns)
+
+
+def read_git_checkout_state(path):
+    state = b''
+    for cmd in (['git', 'rev-parse', 'HEAD', ], ['git', 'status', '--porcelain', ], ['git', 'diff', 'HEAD', ], ):
+        try:
+            state += subprocess.run(cmd, cwd=path, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True).stdout
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return state
+
+
+def get_build_context(group_name, box_name):
+    """
+    Folder of the build context of the "box" and path of its Dockerfile, taken from the "context" and "dockerfile" values of "build.yml".
+    """
+    options = read_service(group_name, box_name, 'build.yml')['build_options']
+    context_dir = os.path.normpath(os.path.join(group_name, options.get('context') or box_name))
+    return context_dir, os.path.normpath(os.path.join(context_dir, options.get('dockerfile') or 'Dockerfile'))
+
+
+def fingerprint_box(group_name, box_name, exclude=()):
+    h = hashlib.sha256()
+    for filename in ('build.header.yml', 'build.footer.yml', ):
+        if os.path.isfile(os.path.join(group_name, filename)):
+            h.update(filename.encode() + b'\0' + open(os.path.join(group_name, filename), 'rb').read() + b'\0')
+    box_dir = os.path.join(group_name, box_name)
+    update_tree_fingerprint(h, box_dir, exclude=exclude, keep=is_box_config_file)
+    context_dir, dockerfile = get_build_context(group_name, box_name)
+    if context_dir != os.path.normpath(box_dir) and os.path.isfile(dockerfile):
+        h.update(b'context\0' + hash_file(dockerfile).encode())
+        update_tree_fingerprint(h, context_dir, sources=read_dockerfile_sources(dockerfile))
+    return h.hexdigest()
+
+
+def update_tree_fingerprint(h, top, exclude=(), keep=None, sources=None):
+    """
+    Adds files of the folder which are not excluded by its ".dockerignore" to the hash, only the ones matching the COPY/ADD sources when they are given.
+    Files in the top folder accepted by "keep" are always added.
+    """
+    patterns = read_dockerignore(top)
+    for root, dirs, files in os.walk(top):
+        rel_root = os.path.relpath(root, top)
+        dirs.sort()
+        for dir_name in list(dirs):
+            rel_path = os.path.normpath(os.path.join(rel_root, dir_name))
+            if is_ignored(rel_path, patterns) and not has_dockerignore_exceptions(rel_path, patterns):
+                dirs.remove(dir_name)
+                continue
+            if os.path.isfile(os.path.join(root, dir_name, '.boxer-checkout')):
+                dirs.remove(dir_name)
+                h.update(rel_path.encode() + b'\0' + open(os.path.join(root, dir_name, '.boxer-checkout'), 'rb').read())
+                continue
+            if os.path.isdir(os.path.join(root, dir_name, '.git')):
+                state = read_git_checkout_state(os.path.join(root, dir_name))
+                if state is not None:
+                    dirs.remove(dir_name)
+                    h.update(rel_path.encode() + b'\0' + hashlib.sha256(state).digest())
+        for filename in sorted(files):
+            rel_path = os.path.normpath(os.path.join(rel_root, filename))
+            if is_ignored(rel_path, patterns) and not (rel_root == '.' and keep and keep(filename)):
+                continue
+            if rel_root == '.' and filename in exclude:
+                continue
+            if sources is not None and '.' not in sources and not any(match_dockerignore_pattern(rel_path, source) for source in sources):
+                continue
+            file_hash = hashlib.sha256()
+            with open(os.path.join(root, filename), 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    file_hash.update(chunk)
+            h.update(rel_path.encode() + b'\0' + file_hash.digest())
+
+
+def read_commit_image(group_name, box_name):
+    path = os.path.join(group_name, box_name, 'commit.sh')
+    if not os.path.isfile(path):
+        return None
+    for line in no_comments(open(path).read()).splitlines():
+        try:
+            words = shlex.split(line)
+        except ValueError:
             continue
-        if not os.path.isfile(os.path.join(group_name, box_name, 'commit.sh')):
+        for pos in range(len(words) - 1):
+            if words[pos] != 'docker' or words[pos + 1] != 'commit':
+                continue
+            positional = []
+            skip_value = False
+            for word in words[pos + 2:]:
+                if skip_value:
+                    skip_value = False
+                elif word in ('-a', '--author', '-c', '--change', '-m', '--message', ):
+                    skip_value = True
+                elif not word.startswith('-'):
+                    positional.append(word)
+            if len(positional) >= 2:
+                return positional[1]
+    return None
+
+
+def docker_image_exists(image):
+    try:
+        return subprocess.run(['docker', 'image', 'inspect', image, ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+    except OSError:
+        return False
+
+
+def read_build_manifest(group_name):
+    path = os.path.join(group_name, 'build.manifest.json')
+    if not os.path.isfile(path):
+        return {}
+    try:
+        return json.loads(open(path).read())
+    except ValueError:
+        return {}
+
+
+def write_build_manifest(group_name, fingerprints, box_names):
+    manifest = read_build_manifest(group_name)
+    for box_name in box_names:
+        manifest[box_name] = {
+            'fingerprint': fingerprints[box_name],
+            'image': read_commit_image(group_name, box_name),
+            'built': time.time(),
+        }
+    open(os.path.join(group_name, 'build.manifest.json'), 'w').write(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+IMAGE_CONFIG_FIELDS = ('Cmd', 'Entrypoint', 'Env', 'ExposedPorts', 'Labels', 'StopSignal', 'User', 'Volumes', 'WorkingDir', )
+
+
+def read_image_info(image):
+    try:
+        info = json.loads(subprocess.run(
+            ['docker', 'image', 'inspect', '--format', '{{json .}}', image, ],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        ).stdout.decode() or 'null')
+    except (OSError, ValueError):
+        return None
+    if not isinstance(info, dict) or not info.get('Id'):
+        return None
+    config = info.get('Config') or {}
+    content = {
+        'layers': (info.get('RootFS') or {}).get('Layers') or [],
+        'config': {field: config.get(field) for field in IMAGE_CONFIG_FIELDS},
+    }
+    return {
+        'image_id': info['Id'],
+        'content': hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest(),
+        'size': info.get('Size') or 0,
+    }
+
+
+def read_push_manifest(group_name):
+    path = os.path.join(group_name, 'push.manifest.json')
+    if not os.path.isfile(path):
+        return {}
+    try:
+        return json.loads(open(path).read())
+    except ValueError:
+        return {}
+
+
+def is_push_required(group_name, box_name, manifest, images):
+    image = read_commit_image(group_name, box_name)
+    info = read_image_info(image) if image else None
+    if not info:
+        return True
+    images[box_name] = dict(info, image=image)
+    previous = manifest.get(box_name, {})
+    if previous.get('image') == image and previous.get('content') == info['content']:
+        print(f'<BOXER> [{box_name}] image [{image}] was not changed since the last push')
+        return False
+    return True
+
+
+def print_push_savings(manifest, images, skipped):
+    if not skipped:
+        return
+    saved_bytes = sum(images[box_name]['size'] for box_name in skipped)
+    saved_seconds = sum(manifest[box_name].get('duration', 0.0) for box_name in skipped)
+    print(f'<BOXER> skipped pushing {len(skipped)} unchanged images, saved {format_size(saved_bytes)} and about {saved_seconds:.1f}s')
+
+
+def write_push_manifest(group_name, results):
+    pushed = {}
+    for box_name, (image, ret, duration) in results.items():
+        if ret == 0 and image:
+            pushed[box_name] = dict(image, duration=duration, pushed=time.time())
+    if not pushed:
+        return
+    manifest = read_push_manifest(group_name)
+    manifest.update(pushed)
+    open(os.path.join(group_name, 'push.manifest.json'), 'w').write(json.dumps(manifest, indent=2, sort_keys=True))
+
+
+def is_box_changed(group_name, box_name, fingerprint, manifest):
+    previous = manifest.get(box_name)
+    if not previous or previous.get('fingerprint') != fingerprint:
+        print(f'<BOXER> [{box_name}] was changed since the last build')
+        return True
+    image = read_commit_image(group_name, box_name)
+    if image and not docker_image_exists(image):
+        print(f'<BOXER> [{box_name}] image [{image}] was not found')
+        return True
+    print(f'<BOXER> [{box_name}] was not changed since the last build')
+    return False
+
+
+def find_changed_boxes(group_name, fingerprints):
+    manifest = read_build_manifest(group_name)
+    return [box_name for box_name, fingerprint in fingerprints.items() if is_box_changed(group_name, box_name, fingerprint, manifest)]
+
+
+def find_required_boxes(group_name, box_names):
+    services = {}
+    depends_on = {}
+    for box_name in list_boxes(group_name):
+        service_name, depends_on[box_name] = read_build_yml_service(group_name, box_name)
+        services[service_name] = box_name
+    required = set()
+    queue = list(box_names)
+    while queue:
+        box_name = queue.pop()
+        if box_name in required:
+            continue
+        required.add(box_name)
+        for service_name in depends_on.get(box_name, []):
+            if service_name in services:
+                queue.append(services[service_name])
+    return sorted(required)
+
+
+def find_touched_boxes(group_name, required, changed):
+    """
+    The changed boxes together with the started boxes whose containers are changed by exec scripts of other boxes,
+    for example a database migrated by "exec.sh" of the application, they must be committed and pushed again as well.
+    """
+    exec_order = {box_name: order_position for box_name, order_position in find_exec_scripts(group_name).items() if box_name in required}
+    dependents = build_exec_dependents(group_name, required, build_exec_dependencies(group_name, exec_order))
+    touched = set(changed)
+    for box_name in required:
+        if box_name not in touched and dependents.get(box_name):
+            print(f'<BOXER> [{box_name}] is changed by exec scripts of {", ".join(sorted(dependents[box_name]))}, it will be committed again')
+            touched.add(box_name)
+    return sorted(touched)
+
+
+def format_size(size):
+    for unit in ('B', 'KB', 'MB', 'GB', ):
+        if size < 1024 or unit == 'GB':
+            break
+        size /= 1024.0
+    return f'{size:.1f} {unit}' if unit != 'B' else f'{size} B'
+
+
+def read_dockerfile_sources(dockerfile):
+    sources = []
+    text = re.sub(r'\\[ \t]*\n', ' ', open(dockerfile).read())
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        instruction, _, rest = line.partition(' ')
+        if instruction.upper() not in ('COPY', 'ADD', ):
+            continue
+        rest = rest.strip()
+        if rest.startswith('['):
+            try:
+                args = json.loads(rest)
+            except ValueError:
+                args = ['.', '', ]
+        else:
+            args = rest.split()
+        if any(arg.startswith('--from') for arg in args):
             continue
-        print(f'<BOXER> executing [commit.sh] in {group_name}/{box_name}/')
-        cd_path = os.path.join(group_name, box_name)
-        ret = os.system(f"/bin/bash -c 'cd {cd_path} && /bin/bash commit.sh' {VERBOSE}")
+        args = [arg for arg in args if not arg.startswith('--')]
+        for source in args[:-1]:
+            if '://' in source or source.startswith('git@') or source.startswith('<<'):
+                continue
+            if '$' in source:
+                source = '.'
+            sources.append(os.path.normpath(source).lstrip('/') or '.')
+    return sorted(set(sources))
+
+
+def analyze_build_context(context_dir, sources, dockerfile='Dockerfile'):
+    patterns = read_dockerignore(context_dir)
+    report = {
+        'files': 0,
+        'total': 0,
+        'referenced': 0,
+        'folders': {},
+    }
+    for root, dirs, files in os.walk(context_dir):
+        rel_root = os.path.relpath(root, context_dir)
+        for dir_name in list(dirs):
+            rel_path = os.path.normpath(os.path.join(rel_root, dir_name))
+            if is_ignored(rel_path, patterns) and not has_dockerignore_exceptions(rel_path, patterns):
+                dirs.remove(dir_name)
+        for filename in files:
+            rel_path = os.path.normpath(os.path.join(rel_root, filename))
+            if is_ignored(rel_path, patterns) and rel_path not in (dockerfile, '.dockerignore', ):
+                continue
+            size = os.lstat(os.path.join(root, filename)).st_size
+            report['files'] += 1
+            report['total'] += size
+            if '.' in sources or any(match_dockerignore_pattern(rel_path, source) for source in sources):
+                report['referenced'] += size
+            folder = rel_root
+            while folder not in ('.', '', ):
+                report['folders'][folder] = report['folders'].get(folder, 0) + size
+                folder = os.path.dirname(folder)
+    return report
+
+
+def write_dockerignore(context_dir, sources, dockerfile='Dockerfile'):
+    lines = [
+        '# Generated by BOXER "context-report" command: only files used by "COPY" and "ADD" instructions are sent to docker.',
+        '*',
+        f'!{dockerfile}',
+    ]
+    lines.extend(f'!{source}' for source in sources)
+    for pattern, negate in read_dockerignore(context_dir):
+        if not negate and pattern != '*' and pattern not in lines:
+            lines.append(pattern)
+    open(os.path.join(context_dir, '.dockerignore'), 'w').write('\n'.join(lines) + '\n')
+
+
+def execute_context_report(group_name, write=False, limit=5):
+    grand_total = 0
+    for box_name in list_boxes(group_name):
+        context_dir, dockerfile = get_build_context(group_name, box_name)
+        if not os.path.isfile(dockerfile):
+            continue
+        dockerfile = os.path.relpath(dockerfile, context_dir)
+        sources = read_dockerfile_sources(os.path.join(context_dir, dockerfile))
+        report = analyze_build_context(context_dir, sources, dockerfile)
+        grand_total += report['total']
+        print(f'<BOXER> [{box_name}] build context [{context_dir}] is {format_size(report["total"])} in {report["files"]} files')
+        print(f'<BOXER>     COPY/ADD sources: {", ".join(sources) or "none"}')
+        print(f'<BOXER>     referenced by COPY/ADD: {format_size(report["referenced"])}, not referenced: {format_size(report["total"] - report["referenced"])}')
+        largest = sorted(report['folders'].items(), key=lambda item: (-item[1], item[0]))[:limit]
+        if largest:
+            print('<BOXER>     largest folders:')
+        for folder, size in largest:
+            print('<BOXER>         {:>10}  {}'.format(format_size(size), folder))
+        if not write:
+            continue
+        if '.' in sources:
+            print(f'<BOXER> [{box_name}] .dockerignore was not changed, the whole build context is used by COPY/ADD')
+            continue
+        write_dockerignore(context_dir, sources, dockerfile)
+        tight = analyze_build_context(context_dir, sources, dockerfile)
+        print(f'<BOXER> [{box_name}] .dockerignore was written, build context is now {format_size(tight["total"])}')
+    print(f'<BOXER> total build context of the group is {format_size(grand_total)}')
+    return 0
+
+
+HELPER_IMAGE = 'alpine'
+
+VOLUME_FINGERPRINT = "find /volume -mindepth 1 -exec stat -c '%n %s %Y' {} + | sort | md5sum"
+
+CONTAINER_FINGERPRINT = '%n %s %y'
+
+
+async def inspect_run_containers(group_name):
+    ret, ids = await capture_process(['docker-compose', '-p', get_settings().alias, '-f', 'docker-compose.run.yml', 'ps', '-q', ], cwd=group_name)
+    ids = ids.split()
+    if ret != 0 or not ids:
+        return {}
+    fmt = '{{index .Config.Labels "com.docker.compose.service"}} {{.Id}} {{.State.Status}} {{.State.StartedAt}} {{range .Mounts}}{{if eq .Type "volume"}}{{.Name}},{{end}}{{end}}'
+    ret, output = await capture_process(['docker', 'inspect', '--format', fmt, ] + ids)
+    if ret != 0:
+        return {}
+    containers = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) < 4:
+            continue
+        containers[fields[0]] = {
+            'id': fields[1],
+            'status': fields[2],
+            'started_at': fields[3],
+            'volumes': sorted(volume for volume in (fields[4] if len(fields) > 4 else '').split(',') if volume),
+        }
+    return containers
+
+
+async def fingerprint_container(container_id, batch_size=500):
+    ret, output = await capture_process(['docker', 'diff', container_id, ])
+    if ret != 0:
+        return None
+    lines = sorted(output.splitlines())
+    h = hashlib.sha256('\n'.join(lines).encode())
+    paths = [line[2:] for line in lines if line[:2] in ('A ', 'C ', )]
+    for pos in range(0, len(paths), batch_size):
+        _, stats = await capture_process(['docker', 'exec', container_id, 'stat', '-c', CONTAINER_FINGERPRINT, '--', ] + paths[pos:pos + batch_size])
+        h.update(stats.encode())
+    return h.hexdigest()
+
+
+async def fingerprint_volume(volume):
+    ret, output = await capture_process(['docker', 'run', '--rm', '-v', f'{volume}:/volume:ro', HELPER_IMAGE, 'sh', '-c', VOLUME_FINGERPRINT, ])
+    if ret != 0:
+        return None
+    return output.strip()
+
+
+async def copy_volume(source, target):
+    ret, _ = await capture_process(['docker', 'volume', 'create', target, ])
+    if ret != 0:
+        return ret
+    ret, _ = await capture_process([
+        'docker', 'run', '--rm', '-v', f'{source}:/from:ro', '-v', f'{target}:/to', HELPER_IMAGE,
+        'sh', '-c', 'rm -rf /to/..?* /to/.[!.]* /to/*; cp -a /from/. /to/',
+    ])
+    return ret
+
+
+def get_checkpoint_image(service_name):
+    return f'boxer-checkpoint-{get_settings().alias}-{service_name}'.lower()
+
+
+def get_checkpoint_volume(volume):
+    return f'{volume}_boxer_checkpoint'
+
+
+def read_checkpoint(group_name):
+    path = os.path.join(group_name, 'checkpoint.json')
+    if not os.path.isfile(path):
+        return None
+    try:
+        return json.loads(open(path).read())
+    except ValueError:
+        return None
+
+
+def write_checkpoint(group_name, checkpoint):
+    open(os.path.join(group_name, 'checkpoint.json'), 'w').write(json.dumps(checkpoint, indent=2, sort_keys=True))
+
+
+def generate_docker_compose_checkpoint_file(group_name, service_names):
+    version = "version: '3.1'\n"
+    for line in open(os.path.join(group_name, 'docker-compose.run.yml')).read().splitlines(keepends=True):
+        if line.startswith('version:'):
+            version = line
+            break
+    yml = [version, '\nservices:\n', ]
+    for service_name in sorted(service_names):
+        yml.append(f'  {service_name}:\n    image: {get_checkpoint_image(service_name)}\n')
+    open(os.path.join(group_name, 'docker-compose.checkpoint.yml'), 'w').write(''.join(yml))
+
+
+async def run_limited(coroutines):
+    semaphore = asyncio.Semaphore(max(1, get_settings().jobs))
+
+    async def _run(coroutine):
+        async with semaphore:
+            return await coroutine
+
+    return await asyncio.gather(*[_run(coroutine) for coroutine in coroutines])
+
+
+async def create_checkpoint(group_name):
+    containers = await inspect_run_containers(group_name)
+    if not containers:
+        print(f'<BOXER> no running containers found in [{get_settings().alias}]')
+        return 1
+    service_names = sorted(containers.keys())
+    volumes = sorted(set(volume for container in containers.values() for volume in container['volumes']))
+    for service_name in service_names:
+        print(f'<BOXER> executing [docker commit {containers[service_name]["id"][:12]} {get_checkpoint_image(service_name)}]')
+    for volume in volumes:
+        print(f'<BOXER> copying volume [{volume}] to [{get_checkpoint_volume(volume)}]')
+    results = await run_limited(
+        [capture_process(['docker', 'commit', containers[service_name]['id'], get_checkpoint_image(service_name), ]) for service_name in service_names] +
+        [fingerprint_container(containers[service_name]['id']) for service_name in service_names] +
+        [copy_volume(volume, get_checkpoint_volume(volume)) for volume in volumes] +
+        [fingerprint_volume(volume) for volume in volumes]
+    )
+    commits = results[:len(service_names)]
+    diffs = results[len(service_names):2 * len(service_names)]
+    copies = results[2 * len(service_names):2 * len(service_names) + len(volumes)]
+    fingerprints = results[2 * len(service_names) + len(volumes):]
+    for service_name, (ret, _) in zip(service_names, commits):
+        if ret != 0:
+            print(f'<BOXER> failed to commit container of [{service_name}]')
+            return ret
+    for volume, ret in zip(volumes, copies):
         if ret != 0:
+            print(f'<BOXER> failed to copy volume [{volume}]')
             return ret
+    checkpoint = {
+        'project': get_settings().alias,
+        'created': time.time(),
+        'services': {},
+        'volumes': {},
+    }
+    for service_name, diff in zip(service_names, diffs):
+        checkpoint['services'][service_name] = dict(containers[service_name], diff=diff, image=get_checkpoint_image(service_name))
+    for volume, fingerprint in zip(volumes, fingerprints):
+        checkpoint['volumes'][volume] = {
+            'snapshot': get_checkpoint_volume(volume),
+            'fingerprint': fingerprint,
+        }
+    write_checkpoint(group_name, checkpoint)
+    generate_docker_compose_checkpoint_file(group_name, service_names)
     return 0
 
 
-def execute_docker_push(group_name):
-    for box_name in os.listdir(group_name):
-        if not box_name.startswith('box.'):
-            continue
-        if not os.path.isdir(os.path.join(group_name, box_name)):
-            continue
-        if not os.path.isfile(os.path.join(group_name, box_name, 'push.sh')):
+async def reset_to_checkpoint(group_name, checkpoint):
+    alias = get_settings().alias
+    containers = await inspect_run_containers(group_name)
+    volumes = sorted(checkpoint['volumes'].keys())
+    service_names = sorted(checkpoint['services'].keys())
+    results = await run_limited(
+        [fingerprint_container(containers[service_name]['id']) for service_name in service_names if service_name in containers] +
+        [fingerprint_volume(volume) for volume in volumes]
+    )
+    diffs = dict(zip([service_name for service_name in service_names if service_name in containers], results))
+    changed_volumes = [volume for volume, fingerprint in zip(volumes, results[len(diffs):]) if fingerprint != checkpoint['volumes'][volume]['fingerprint']]
+    changed = set()
+    for service_name in service_names:
+        saved = checkpoint['services'][service_name]
+        current = containers.get(service_name)
+        if not current:
+            print(f'<BOXER> [{service_name}] container is not running')
+        elif current['id'] != saved['id'] or current['started_at'] != saved['started_at'] or current['status'] != 'running':
+            print(f'<BOXER> [{service_name}] container was restarted or replaced')
+        elif diffs[service_name] != saved['diff']:
+            print(f'<BOXER> [{service_name}] container files were changed')
+        elif set(saved['volumes']) & set(changed_volumes):
+            print(f'<BOXER> [{service_name}] volumes were changed')
+        else:
             continue
-        print(f'<BOXER> executing [push.sh] in {group_name}/{box_name}/')
-        cd_path = os.path.join(group_name, box_name)
-        ret = os.system(f"/bin/bash -c 'cd {cd_path} && /bin/bash push.sh' {VERBOSE}")
+        changed.add(service_name)
+    for service_name in service_names:
+        if set(checkpoint['services'][service_name]['volumes']) & set(changed_volumes):
+            changed.add(service_name)
+    if not changed:
+        print('<BOXER> all containers are already at the checkpoint')
+        return 0
+    changed = sorted(changed)
+    restore_volumes = sorted(changed_volumes)
+    print(f'<BOXER> executing [docker-compose -p {alias} stop {" ".join(changed)}] in {group_name}/')
+    ret = await run_process(['docker-compose', '-p', alias, '-f', 'docker-compose.run.yml', 'stop', ] + changed, cwd=group_name, prefix='[stop] ')
+    if ret != 0:
+        return ret
+    for volume in restore_volumes:
+        print(f'<BOXER> restoring volume [{volume}] from [{checkpoint["volumes"][volume]["snapshot"]}]')
+    for volume, ret in zip(restore_volumes, await run_limited([copy_volume(checkpoint['volumes'][volume]['snapshot'], volume) for volume in restore_volumes])):
         if ret != 0:
+            print(f'<BOXER> failed to restore volume [{volume}]')
             return ret
+    print(f'<BOXER> executing [docker-compose -p {alias} up --force-recreate {" ".join(changed)}] in {group_name}/')
+    ret = await run_process([
+        'docker-compose', '-p', alias, '-f', 'docker-compose.run.yml', '-f', 'docker-compose.checkpoint.yml',
+        'up', '--detach', '--no-deps', '--no-build', '--force-recreate',
+    ] + changed, cwd=group_name, prefix='[up] ')
+    if ret != 0:
+        return ret
+    containers = await inspect_run_containers(group_name)
+    recreated = [service_name for service_name in changed if service_name in containers]
+    results = await run_limited([fingerprint_container(containers[service_name]['id']) for service_name in recreated])
+    for service_name, diff in zip(recreated, results):
+        checkpoint['services'][service_name].update(containers[service_name], diff=diff)
+    write_checkpoint(group_name, checkpoint)
+    print(f'<BOXER> recreated {len(changed)} of {len(service_names)} containers: {", ".join(changed)}')
     return 0
 
 
+@timed_stage
+def execute_checkpoint(group_name):
+    return asyncio.run(create_checkpoint(group_name))
+
+
+@timed_stage
+def execute_reset(group_name):
+    checkpoint = read_checkpoint(group_name)
+    if not checkpoint:
+        print(f'<BOXER> checkpoint was not found in {group_name}/, use the "checkpoint" command first')
+        return 1
+    return asyncio.run(reset_to_checkpoint(group_name, checkpoint))
+
+
+def get_image_cache_dir():
+    return os.path.join(get_cache_dir(), 'images')
+
+
+def get_image_record_path(image):
+    return os.path.join(get_image_cache_dir(), hashlib.sha1(image.encode()).hexdigest() + '.json')
+
+
+def find_box_images(group_name):
+    """
+    Image of every "box", the one created by "docker commit" in "commit.sh" or the one named in "run.yml".
+    """
+    index = get_group_index(group_name)
+    images = {}
+    for box_name in sorted(set(index.box_names('commit.sh') + index.box_names('run.yml'))):
+        image = read_commit_image(group_name, box_name) or read_service(group_name, box_name, 'run.yml')['image']
+        if image:
+            images[box_name] = image
+    return images
+
+
+def read_image_id(image):
+    try:
+        proc = subprocess.run(['docker', 'image', 'inspect', '--format', '{{.Id}}', image, ], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    except OSError:
+        return None
+    return proc.stdout.strip() if proc.returncode == 0 else None
+
+
+def store_image_blob(fileobj, blobs_dir, chunk_size=1024 * 1024):
+    """
+    Compresses the content into the blobs folder while reading it chunk by chunk, returns the digest and the number of newly stored bytes.
+    """
+    digest = hashlib.sha256()
+    temp_path = os.path.join(blobs_dir, f'.{uuid.uuid4().hex}.tmp')
+    try:
+        with gzip.open(temp_path, 'wb', compresslevel=6) as f:
+            while True:
+                chunk = fileobj.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+        path = os.path.join(blobs_dir, digest.hexdigest() + '.gz')
+        if os.path.isfile(path):
+            return digest.hexdigest(), 0
+        stored = os.path.getsize(temp_path)
+        os.replace(temp_path, path)
+        return digest.hexdigest(), stored
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+
+
+def export_image(image):
+    """
+    Streams "docker save" output into the image cache, every file of the archive, including the image layers,
+    is stored once by its digest, so layers shared between images take the space only once.
+    Returns the exit code, the size of the image, the number of newly stored bytes and a message.
+    """
+    image_id = read_image_id(image)
+    if not image_id:
+        return 1, 0, 0, f'image [{image}] was not found, nothing to export'
+    record_path = get_image_record_path(image)
+    if os.path.isfile(record_path) and json.loads(open(record_path).read()).get('id') == image_id:
+        return 0, 0, 0, f'image [{image}] is already exported'
+    blobs_dir = os.path.join(get_image_cache_dir(), 'blobs')
+    os.makedirs(blobs_dir, exist_ok=True)
+    members = []
+    size = 0
+    stored = 0
+    error = None
+    proc = subprocess.Popen(['docker', 'save', image, ], stdout=subprocess.PIPE)
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode='r|') as tar:
+            for member in tar:
+                item = {'name': member.name, 'type': member.type.decode(), 'mode': member.mode, 'mtime': member.mtime, 'linkname': member.linkname, 'size': member.size, }
+                if member.isfile():
+                    known = re.match(r'^blobs/sha256/([0-9a-f]{64})$', member.name)
+                    if known and os.path.isfile(os.path.join(blobs_dir, known.group(1) + '.gz')):
+                        item['digest'] = known.group(1)
+                    else:
+                        item['digest'], blob_size = store_image_blob(tar.extractfile(member), blobs_dir)
+                        stored += blob_size
+                    size += member.size
+                members.append(item)
+    except (tarfile.TarError, OSError) as e:
+        error = e
+        proc.kill()
+    finally:
+        proc.stdout.close()
+    ret = proc.wait()
+    if ret != 0 or error:
+        return ret or 1, 0, stored, f'failed to export image [{image}]: {error or "docker save failed"}'
+    record = {'image': image, 'id': image_id, 'exported': time.time(), 'size': size, 'members': members, }
+    open(record_path + '.tmp', 'w').write(json.dumps(record, indent=2))
+    os.replace(record_path + '.tmp', record_path)
+    return 0, size, stored, f'image [{image}] of {format_size(size)} exported, {format_size(stored)} of new data stored'
+
+
+def import_image(image):
+    """
+    Builds the "docker save" archive again from the image cache and streams it into "docker load".
+    Returns the exit code, the size of the image and a message.
+    """
+    if docker_image_exists(image):
+        return 0, 0, f'image [{image}] already exists'
+    record_path = get_image_record_path(image)
+    if not os.path.isfile(record_path):
+        return 0, 0, f'image [{image}] was not found in [{get_image_cache_dir()}]'
+    record = json.loads(open(record_path).read())
+    blobs_dir = os.path.join(get_image_cache_dir(), 'blobs')
+    missing = [item['name'] for item in record['members'] if 'digest' in item and not os.path.isfile(os.path.join(blobs_dir, item['digest'] + '.gz'))]
+    if missing:
+        return 1, 0, f'image [{image}] can not be imported, {len(missing)} files are missing in [{blobs_dir}]'
+    error = None
+    proc = subprocess.Popen(['docker', 'load', '--quiet', ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL)
+    try:
+        with tarfile.open(fileobj=proc.stdin, mode='w|') as tar:
+            for item in record['members']:
+                member = tarfile.TarInfo(item['name'])
+                member.type = item['type'].encode()
+                member.mode = item['mode']
+                member.mtime = item['mtime']
+                member.linkname = item['linkname']
+                if 'digest' not in item:
+                    tar.addfile(member)
+                    continue
+                member.size = item['size']
+                with gzip.open(os.path.join(blobs_dir, item['digest'] + '.gz'), 'rb') as f:
+                    tar.addfile(member, f)
+    except (tarfile.TarError, OSError) as e:
+        error = e
+        proc.kill()
+    finally:
+        proc.stdin.close()
+    ret = proc.wait()
+    if ret != 0 or error:
+        return ret or 1, 0, f'failed to import image [{image}]: {error or "docker load failed"}'
+    return 0, record['size'], f'image [{image}] of {format_size(record["size"])} imported'
+
+
+async def transfer_images(images, title, func):
+
+    async def _run(box_name):
+        print(f'<BOXER> [{box_name}] {title} image [{images[box_name]}]')
+        result = await asyncio.get_event_loop().run_in_executor(None, contextvars.copy_context().run, func, images[box_name])
+        print(f'<BOXER> [{box_name}] {result[-1]}')
+        return result
+
+    box_names = sorted(images.keys())
+    return dict(zip(box_names, await run_limited([_run(box_name) for box_name in box_names])))
+
+
+@timed_stage
+def execute_export(group_name):
+    images = find_box_images(group_name)
+    if not images:
+        print(f'<BOXER> no images found in {group_name}/, nothing to export')
+        return 0
+    results = asyncio.run(transfer_images(images, 'exporting', export_image))
+    size = sum(result[1] for result in results.values())
+    stored = sum(result[2] for result in results.values())
+    print(f'<BOXER> exported {format_size(size)} of images into [{get_image_cache_dir()}], {format_size(stored)} of new data stored')
+    failed = [box_name for box_name in sorted(results.keys()) if results[box_name][0] != 0]
+    return results[failed[0]][0] if failed else 0
+
+
+@timed_stage
+def execute_import(group_name):
+    images = find_box_images(group_name)
+    if not images:
+        print(f'<BOXER> no images found in {group_name}/, nothing to import')
+        return 0
+    results = asyncio.run(transfer_images(images, 'importing', import_image))
+    print(f'<BOXER> imported {format_size(sum(result[1] for result in results.values()))} of images from [{get_image_cache_dir()}]')
+    failed = [box_name for box_name in sorted(results.keys()) if results[box_name][0] != 0]
+    return results[failed[0]][0] if failed else 0
+
+
 def init_group(group_name, containers):
     group_dir = os.path.join(os.getcwd(), group_name)
     if os.path.exists(group_dir):
         print(f'path {group_dir} already exists')
-        sys.exit(1)
-        return
+        raise BoxerError(f'path {group_dir} already exists')
     os.mkdir(group_dir)
     open(os.path.join(group_dir, 'build.header.yml'), 'w').write(
         """# This file is a header of the "docker-compose.build.yml" file that will be generated by BOXER "build" command.
@@ -396,6 +2989,631 @@ ANOTHER_ENV_VARIABLE_IN_CONTAINER_{container_name.upper()}=some_another_value
     return
 
 
+STATS_FIELDS = ('time', 'project', 'service', 'container', 'cpu_percent', 'mem_bytes', 'mem_limit', 'net_rx', 'net_tx', 'block_read', 'block_write', 'pids', )
+
+SIZE_UNITS = {
+    'b': 1, 'kb': 1000, 'mb': 1000 ** 2, 'gb': 1000 ** 3, 'tb': 1000 ** 4,
+    'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'tib': 1024 ** 4,
+}
+
+
+def parse_docker_size(text):
+    found = re.match(r'^\s*([\d.]+)\s*([a-zA-Z]*)\s*$', text)
+    if not found:
+        return None
+    return int(round(float(found.group(1)) * SIZE_UNITS.get(found.group(2).lower() or 'b', 1)))
+
+
+def parse_docker_stats(stats):
+    try:
+        mem_bytes, _, mem_limit = stats['MemUsage'].partition('/')
+        net_rx, _, net_tx = stats['NetIO'].partition('/')
+        block_read, _, block_write = stats['BlockIO'].partition('/')
+        sample = {
+            'cpu_percent': float(stats['CPUPerc'].rstrip('%')),
+            'mem_bytes': parse_docker_size(mem_bytes),
+            'mem_limit': parse_docker_size(mem_limit),
+            'net_rx': parse_docker_size(net_rx),
+            'net_tx': parse_docker_size(net_tx),
+            'block_read': parse_docker_size(block_read),
+            'block_write': parse_docker_size(block_write),
+            'pids': int(stats.get('PIDs') or 0),
+        }
+    except (KeyError, ValueError, AttributeError, ):
+        return None
+    if None in sample.values():
+        return None
+    return sample
+
+
+async def find_stats_containers(group_name):
+    targets = get_run_targets(group_name)
+    targets += [(get_replica_project(replica), f'docker-compose.run.{replica}.yml', ) for replica in find_replicas(group_name)]
+    ids = []
+    for project, compose_file in targets:
+        ret, output = await capture_process(['docker-compose', '-p', project, '-f', compose_file, 'ps', '-q', ], cwd=group_name)
+        if ret == 0:
+            ids.extend(output.split())
+    if not ids:
+        return {}
+    fmt = '{{.Id}} {{index .Config.Labels "com.docker.compose.project"}} {{index .Config.Labels "com.docker.compose.service"}}'
+    ret, output = await capture_process(['docker', 'inspect', '--format', fmt, ] + ids)
+    if ret != 0:
+        return {}
+    containers = {}
+    for line in output.splitlines():
+        fields = line.split()
+        if len(fields) == 3:
+            containers[fields[0]] = (fields[1], fields[2], )
+    return containers
+
+
+async def sample_stats(containers, duration, interval, write_sample):
+    proc = await asyncio.create_subprocess_exec(
+        'docker', 'stats', '--format', '{{json .}}', *sorted(containers.keys()),
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    latest = {}
+
+    async def _read():
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                break
+            text = re.sub(r'\x1b\[[0-9;]*[A-Za-z]', '', line.decode(errors='replace')).strip()
+            if not text.startswith('{'):
+                continue
+            try:
+                stats = json.loads(text)
+            except ValueError:
+                continue
+            for container_id in containers:
+                if stats.get('ID') and container_id.startswith(stats['ID']):
+                    latest[container_id] = stats
+
+    reader = asyncio.ensure_future(_read())
+    started = time.monotonic()
+    next_sample = started + interval
+    try:
+        while next_sample <= started + duration and not reader.done():
+            await asyncio.sleep(max(0.0, next_sample - time.monotonic()))
+            for container_id, stats in sorted(latest.items()):
+                sample = parse_docker_stats(stats)
+                if sample:
+                    project, service = containers[container_id]
+                    write_sample(dict(sample, time=round(next_sample - started, 3), project=project, service=service, container=container_id[:12]))
+            next_sample += interval
+    except asyncio.CancelledError:
+        print('<BOXER> stopped collecting resource usage')
+    finally:
+        stop_process(proc)
+        await proc.wait()
+        reader.cancel()
+    return time.monotonic() - started
+
+
+def print_stats_summary(summary):
+    print('<BOXER>     {:<24} {:>8} {:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+        'project / service', 'cpu avg', 'cpu max', 'mem avg', 'mem max', 'net rx', 'net tx', 'block rd', 'block wr'))
+    for name, item in sorted(summary.items()):
+        print('<BOXER>     {:<24} {:>7.1f}% {:>7.1f}% {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            name,
+            item['cpu_avg'],
+            item['cpu_max'],
+            format_size(item['mem_avg']),
+            format_size(item['mem_max']),
+            format_size(item['net_rx']),
+            format_size(item['net_tx']),
+            format_size(item['block_read']),
+            format_size(item['block_write']),
+        ))
+
+
+def execute_stats(group_name, duration, interval, output=None):
+    containers = asyncio.run(find_stats_containers(group_name))
+    if not containers:
+        print(f'<BOXER> no running containers found in [{get_settings().alias}]')
+        return None
+    output = output or os.path.join(group_name, 'stats.jsonl')
+    summary = {}
+    with open(output, 'w') as f:
+        if output.endswith('.csv'):
+            f.write(','.join(STATS_FIELDS) + '\n')
+
+        def _write_sample(sample):
+            if output.endswith('.csv'):
+                f.write(','.join(str(sample[field]) for field in STATS_FIELDS) + '\n')
+            else:
+                f.write(json.dumps(sample, sort_keys=True) + '\n')
+            f.flush()
+            item = summary.setdefault(f'{sample["project"]}/{sample["service"]}', {
+                'samples': 0,
+                'cpu_avg': 0.0,
+                'cpu_max': 0.0,
+                'mem_avg': 0,
+                'mem_max': 0,
+            })
+            item['samples'] += 1
+            item['cpu_avg'] += (sample['cpu_percent'] - item['cpu_avg']) / item['samples']
+            item['cpu_max'] = max(item['cpu_max'], sample['cpu_percent'])
+            item['mem_avg'] += int((sample['mem_bytes'] - item['mem_avg']) / item['samples'])
+            item['mem_max'] = max(item['mem_max'], sample['mem_bytes'])
+            for field in ('net_rx', 'net_tx', 'block_read', 'block_write', ):
+                item[field] = sample[field]
+
+        print(f'<BOXER> collecting resource usage of {len(containers)} containers every {interval}s during {duration}s')
+        elapsed = asyncio.run(sample_stats(containers, duration, interval, _write_sample))
+    print(f'<BOXER> resource usage in {elapsed:.1f}s saved to [{output}]:')
+    if summary:
+        print_stats_summary(summary)
+    return summary
+
+
+ExecResult = collections.namedtuple('ExecResult', ['container', 'project', 'exit_code', 'stdout', 'stderr', ])
+
+
+async def capture_exec(group_name, project, compose_file, container, command, env, timeout):
+    proc = await asyncio.create_subprocess_exec(
+        'docker-compose', '-p', project, '-f', compose_file, 'exec', '-T', *env, container, *command,
+        cwd=group_name,
+        stdin=asyncio.subprocess.DEVNULL,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        stop_process(proc)
+        await proc.wait()
+        return ExecResult(container, project, 124, '', f'stopped after {timeout} seconds timeout\n')
+    return ExecResult(container, project, proc.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace'))
+
+
+def execute_docker_compose_run_exec_capture(group_name, container, command, replicas=1, timeout=None):
+    coroutines = []
+    for _, project, compose_file, target, env in get_exec_targets(group_name, get_exec_containers(container), replicas):
+        coroutines.append(capture_exec(group_name, project, compose_file, target, command, env, timeout))
+    return list(asyncio.run(run_limited(coroutines)))
+
+
+class Group(object):
+    """
+    Group of containers which can be built, started and stopped from Python code, for example in pytest fixtures:
+
+        @pytest.fixture(scope='session')
+        def group():
+            with boxer.Group('django_celery_example') as group:
+                yield group
+
+        def test_celery(group):
+            result = group.exec('tester', ['pytest', 'tests/', ])
+            assert result.exit_code == 0, result.stdout
+
+    Every command raises BoxerError when one of its steps failed.
+    """
+
+    def __init__(self, name, folder=None, quite=False, jobs=None, force=False, timeout=None, cache_dir=None,
+                 build_backend='compose', log_max_size=10, log_compress=False, timings=False, wait_timeout=300, pipeline=False):
+        if name.endswith('.boxes'):
+            name = name[:-len('.boxes')]
+        self.name = name
+        self.group_name = os.path.join(folder, f'{name}.boxes') if folder else f'{name}.boxes'
+        self.wait_timeout = wait_timeout
+        self.settings = Settings(
+            alias=name.lower(),
+            quite=quite,
+            jobs=jobs,
+            force=force,
+            timeout=timeout,
+            cache_dir=cache_dir,
+            build_backend=build_backend,
+            log_max_size=int(log_max_size * 1024 * 1024),
+            log_compress=log_compress,
+            print_timings=timings,
+            pipeline=pipeline,
+        )
+
+    def __enter__(self):
+        self.start(wait=True)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def run(self, func, *args, **kwargs):
+        token = SETTINGS.set(self.settings)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            SETTINGS.reset(token)
+
+    def run_command(self, command, func, *args, **kwargs):
+        def _run():
+            print(f'<BOXER> network group name is [{self.group_name}]')
+            print(f'<BOXER> target folder is [{os.path.abspath(self.group_name)}]')
+            start_timings(self.group_name, command)
+            try:
+                func(*args, **kwargs)
+                update_group_state(self.group_name, last_command=command)
+                report = write_timings_report()
+            finally:
+                self.settings.timings = None
+            print('<BOXER> done')
+            return report
+        return self.run(_run)
+
+    def init(self, containers):
+        self.run(init_group, self.group_name, containers)
+
+    def build(self):
+        """
+        Builds images of all "boxes" which were changed since the last build, returns the timings report.
+        """
+        return self.run_command('build', build_group, self.group_name)
+
+    def start(self, detach=True, wait=False, replicas=1):
+        """
+        Starts all containers, by default in the background, returns the timings report.
+        """
+        return self.run_command('start', start_group, self.group_name, detach=detach or wait, wait=wait, wait_timeout=self.wait_timeout, replicas=replicas)
+
+    def stop(self):
+        return self.run_command('stop', lambda: check_ret(execute_docker_compose_run_down(self.group_name)))
+
+    def checkpoint(self):
+        return self.run_command('checkpoint', lambda: check_ret(execute_checkpoint(self.group_name)))
+
+    def reset(self):
+        return self.run_command('reset', lambda: check_ret(execute_reset(self.group_name)))
+
+    def export_images(self):
+        return self.run_command('export', lambda: check_ret(execute_export(self.group_name)))
+
+    def import_images(self):
+        return self.run_command('import', lambda: check_ret(execute_import(self.group_name)))
+
+    def watch(self, debounce=0.5):
+        """
+        Watches files of all "boxes" and builds again and recreates only the changed ones, until KeyboardInterrupt is raised.
+        """
+        self.run(watch_group, self.group_name, debounce=debounce)
+
+    def stats(self, duration=60, interval=5, output=None):
+        """
+        Samples CPU, memory, network and block IO of all running containers into a CSV or JSON lines file,
+        returns a summary with average and peak values for every service.
+        """
+        return self.run(execute_stats, self.group_name, duration, interval, output=output)
+
+    def plan(self, command='build'):
+        """
+        Estimates the time every step of the "build" or "start" command will take from the previous runs,
+        returns the plan with the critical path and the total time.
+        """
+        return self.run(execute_plan, self.group_name, command)
+
+    def context_report(self, write=False):
+        self.run(lambda: check_ret(execute_context_report(self.group_name, write=write)))
+
+    def services(self):
+        """
+        Names of all services of the group, for example to execute a command in all of them with exec().
+        """
+        return self.run(find_run_services, self.group_name)
+
+    def exec(self, container, command, replicas=1, timeout=None):
+        """
+        Executes a command inside of a running container and returns ExecResult with its exit code and output.
+        The "container" can also be a list or a comma separated string of names, then the command is executed in all of them at the same time
+        and a list of ExecResult objects is returned, one for every container in every copy of the group, the same when "replicas" is more than 1.
+        """
+        if isinstance(command, str):
+            command = shlex.split(command)
+        results = self.run(execute_docker_compose_run_exec_capture, self.group_name, container, command, replicas=replicas, timeout=timeout)
+        return results[0] if replicas <= 1 and len(get_exec_containers(container)) == 1 else results
+
+    def exec_stream(self, container, command, replicas=1, gather=False):
+        """
+        Executes a command inside of one or more running containers printing the output, returns the exit code of the first failed command.
+        With "gather" the output of every container is printed at once when its command has finished.
+        """
+        return self.run(execute_docker_compose_run_exec, self.group_name, container, command, replicas=replicas, gather=gather)
+
+    def exec_batch(self, container, path):
+        return self.run(execute_docker_compose_run_exec_batch, self.group_name, container, path)
+
+
+def build_group(group_name):
+    generate_docker_compose_build_file(group_name)
+    check_ret(execute_docker_compose_build_down(group_name))
+    fingerprints = {}
+    changed = []
+    built = []
+    if get_settings().pipeline and get_settings().build_backend == 'buildx':
+        check_ret(execute_declarative_checkout(group_name))
+        check_ret(execute_checkout_build_pipeline(group_name, fingerprints, changed, built))
+    else:
+        check_ret(execute_checkout(group_name))
+        fingerprints = {box_name: fingerprint_box(group_name, box_name) for box_name in list_boxes(group_name)}
+        if get_settings().force:
+            changed = sorted(fingerprints.keys())
+        else:
+            changed = find_changed_boxes(group_name, fingerprints)
+    if not changed:
+        print('<BOXER> all boxes are up to date, use "--force" to build them again')
+        return
+    build_changed_boxes(group_name, fingerprints, changed, built=built)
+
+
+def build_changed_boxes(group_name, fingerprints, changed, built=(), push=True):
+    required = find_required_boxes(group_name, changed)
+    changed = find_touched_boxes(group_name, required, changed)
+    for box_name in changed:
+        if fingerprints.get(box_name) is None:
+            fingerprints[box_name] = fingerprint_box(group_name, box_name)
+    services = None
+    if len(required) < len(fingerprints):
+        services = [read_build_yml_service(group_name, box_name)[0] for box_name in required]
+    check_ret(execute_docker_compose_build(group_name, services, built=built))
+    if get_settings().pipeline:
+        check_ret(execute_box_pipeline(group_name, required, changed, push=push))
+    else:
+        check_ret(execute_docker_exec(group_name, required))
+        check_ret(execute_docker_commit(group_name, changed))
+        if push:
+            check_ret(execute_docker_push(group_name, changed))
+    write_build_manifest(group_name, fingerprints, changed)
+    check_ret(execute_docker_compose_build_down(group_name))
+
+
+def start_group(group_name, detach=False, wait=False, wait_timeout=300, replicas=1):
+    generate_docker_compose_run_file(group_name)
+    check_ret(execute_docker_compose_run(group_name, detach=detach, replicas=replicas))
+    if wait:
+        check_ret(execute_wait_ready(group_name, wait_timeout, replicas=replicas))
+
+
+class InotifyWatcher(object):
+    """
+    Watches folders with Linux "inotify" through ctypes, sub-folders created later are watched as well.
+    """
+
+    EVENTS = 0x2 | 0x4 | 0x8 | 0x40 | 0x80 | 0x100 | 0x200 | 0x400  # modify, attrib, close_write, moved_from, moved_to, create, delete, delete_self
+    IS_DIR = 0x40000000
+    IGNORED = 0x8000
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self.skip = None
+
+    def add(self, path):
+        for root, dirs, _ in os.walk(path):
+            dirs[:] = [dir_name for dir_name in dirs if not (self.skip and self.skip(os.path.join(root, dir_name)))]
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(root), self.EVENTS)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f'can not watch [{root}]')
+            self.watches[wd] = root
+
+    def read(self, timeout=None):
+        readable, _, _ = select.select([self.fd, ], [], [], timeout)
+        if not readable:
+            return set()
+        paths = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = struct.unpack_from('iIII', data, offset)
+                name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+                offset += 16 + length
+                if mask & self.IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+                if wd not in self.watches:
+                    continue
+                path = os.path.join(self.watches[wd], os.fsdecode(name)) if name else self.watches[wd]
+                if mask & self.IS_DIR and mask & (0x80 | 0x100) and os.path.isdir(path) and not (self.skip and self.skip(path)):
+                    self.add(path)
+                paths.add(path)
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """
+    Compares modification times of all files every second, used where "inotify" is not available.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.roots = []
+        self.files = {}
+        self.skip = None
+
+    def scan(self):
+        files = {}
+        for path in self.roots:
+            for root, dirs, filenames in os.walk(path):
+                dirs[:] = [dir_name for dir_name in dirs if not (self.skip and self.skip(os.path.join(root, dir_name)))]
+                files[root] = None
+                for filename in filenames:
+                    try:
+                        st = os.stat(os.path.join(root, filename))
+                    except OSError:
+                        continue
+                    files[os.path.join(root, filename)] = (st.st_mtime_ns, st.st_size, )
+        return files
+
+    def add(self, path):
+        self.roots.append(path)
+        self.files = self.scan()
+
+    def read(self, timeout=None):
+        started = time.monotonic()
+        while True:
+            time.sleep(self.interval if timeout is None else max(0, min(self.interval, timeout - (time.monotonic() - started))))
+            files = self.scan()
+            paths = {path for path in files.keys() | self.files.keys() if files.get(path) != self.files.get(path)}
+            self.files = files
+            if paths or (timeout is not None and time.monotonic() - started >= timeout):
+                return paths
+
+    def close(self):
+        pass
+
+
+def make_watcher():
+    if sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError) as e:
+            print(f'<BOXER> inotify is not available ({e}), checking files every second instead')
+    return PollingWatcher()
+
+
+def is_watch_skipped(group_name, path):
+    rel_path = os.path.relpath(path, group_name)
+    parts = rel_path.split(os.sep)
+    if not parts[0].startswith('box.') or parts[-1] == '.git':
+        return True
+    if len(parts) == 1:
+        return False
+    box_dir = os.path.join(group_name, parts[0])
+    if os.path.isfile(os.path.join(path, '.boxer-checkout')):
+        return True
+    patterns = read_dockerignore(box_dir)
+    box_path = os.path.join(*parts[1:])
+    return is_ignored(box_path, patterns) and not has_dockerignore_exceptions(box_path, patterns)
+
+
+def wait_box_changes(group_name, watcher, debounce):
+    """
+    Blocks until files of the group were changed and no more changes came in during the "debounce" seconds,
+    returns the changed files of every "box" and whether the headers or footers of the group were changed.
+    """
+    changes = collections.defaultdict(set)
+    group_files = False
+    paths = watcher.read()
+    while paths:
+        for path in paths:
+            parts = os.path.relpath(path, group_name).split(os.sep)
+            if parts[0].startswith('box.'):
+                changes[parts[0]].add(os.path.join(*parts[1:]) if len(parts) > 1 else '')
+            elif len(parts) == 1 and re.match(r'^(build|run)\.(header|footer)\.yml$', parts[0]):
+                group_files = True
+        paths = watcher.read(timeout=debounce)
+    return changes, group_files
+
+
+@timed_stage
+def execute_docker_compose_run_recreate(group_name, service_names, build=False):
+    alias = get_settings().alias
+    print(f'<BOXER> executing [docker-compose -p {alias} up --detach --no-deps --force-recreate{" --build" if build else ""} {" ".join(service_names)}] in {group_name}/')
+    cmd = ['docker-compose', '-p', alias, '-f', 'docker-compose.run.yml', 'up', '--detach', '--no-deps', '--force-recreate', ]
+    if build:
+        cmd.append('--build')
+    ret = run_command(cmd + get_settings().quite_pull + service_names, cwd=group_name)
+    if ret == 0:
+        update_group_state(
+            group_name,
+            project=alias,
+            compose_hash=hash_file(os.path.join(group_name, 'docker-compose.run.yml')),
+            context_hash=fingerprint_run_context(group_name),
+            containers=list_project_containers(group_name, alias, 'docker-compose.run.yml') or [],
+        )
+    return ret
+
+
+def fingerprint_watched_box(group_name, box_name):
+    """
+    Fingerprint of the build context without "run.yml" together with the hash of "run.yml",
+    so a change of "run.yml" only recreates the container without building the image again.
+    """
+    run_yml = os.path.join(group_name, box_name, 'run.yml')
+    return fingerprint_box(group_name, box_name, exclude=('run.yml', )), hash_file(run_yml) if os.path.isfile(run_yml) else None
+
+
+def update_changed_boxes(group_name, changes, group_files, fingerprints):
+    """
+    Regenerates the compose files when their parts were changed, builds again only the "boxes" whose build context was changed
+    and recreates only their containers when the group is running.
+    """
+    index = get_group_index(group_name)
+    if group_files or any(filename in ('build.yml', 'run.yml', '', ) for files in changes.values() for filename in files):
+        generate_docker_compose_build_file(group_name)
+        generate_docker_compose_run_file(group_name)
+    build_boxes = list_boxes(group_name)
+    run_boxes = index.box_names('run.yml')
+    rebuild = []
+    recreate = []
+    for box_name in sorted(changes.keys()):
+        if not os.path.isdir(os.path.join(group_name, box_name)):
+            print(f'<BOXER> [{box_name}] was removed')
+            fingerprints.pop(box_name, None)
+            continue
+        previous = fingerprints.get(box_name, (None, None, ))
+        fingerprints[box_name] = fingerprint_watched_box(group_name, box_name)
+        if fingerprints[box_name] == previous:
+            print(f'<BOXER> [{box_name}] no changes in the build context')
+            continue
+        if box_name in build_boxes and fingerprints[box_name][0] != previous[0]:
+            rebuild.append(box_name)
+        if box_name in run_boxes:
+            recreate.append(box_name)
+    if rebuild:
+        print(f'<BOXER> building again {", ".join(rebuild)}')
+        manifest_fingerprints = dict.fromkeys(build_boxes)
+        manifest_fingerprints.update({box_name: fingerprint_box(group_name, box_name) for box_name in rebuild})
+        build_changed_boxes(group_name, manifest_fingerprints, rebuild, push=False)
+    if not recreate:
+        return
+    if not read_group_state(group_name)['projects'].get(get_settings().alias, {}).get('running'):
+        print(f'<BOXER> containers of [{get_settings().alias}] are not running, use the "start" command to start them')
+        return
+    services = [read_service(group_name, box_name, 'run.yml') for box_name in recreate]
+    check_ret(execute_docker_compose_run_recreate(group_name, [service['name'] for service in services], build=any(service['build'] for service in services)))
+
+
+def watch_group(group_name, debounce=0.5):
+    watcher = make_watcher()
+    watcher.skip = functools.partial(is_watch_skipped, group_name)
+    watcher.add(group_name)
+    fingerprints = {box_name: fingerprint_watched_box(group_name, box_name) for box_name in get_group_index(group_name).box_names()}
+    print(f'<BOXER> watching {len(fingerprints)} boxes in {group_name}/ with {watcher.__class__.__name__}, press Ctrl+C to stop')
+    try:
+        while True:
+            changes, group_files = wait_box_changes(group_name, watcher, debounce)
+            if not changes and not group_files:
+                continue
+            print(f'<BOXER> changes detected in {", ".join(sorted(changes.keys())) or "headers or footers"}')
+            started = time.monotonic()
+            start_timings(group_name, 'watch')
+            try:
+                update_changed_boxes(group_name, changes, group_files, fingerprints)
+            except BoxerError:
+                print('<BOXER> waiting for the next change')
+                continue
+            write_timings_report()
+            print(f'<BOXER> updated in {time.monotonic() - started:.1f}s, waiting for the next change')
+    except KeyboardInterrupt:
+        print('<BOXER> stopped watching')
+    finally:
+        watcher.close()
+
+
 class CustomArgumentParser(argparse.ArgumentParser):
 
     def format_help(self):
@@ -403,25 +3621,34 @@ class CustomArgumentParser(argparse.ArgumentParser):
 
 
 def get_group_name(args):
-    global ALIAS
     if not args.group_name:
         print('must provide a name of the target group of containers, use the "--group-name input" argument')
         sys.exit(1)
         return
-    group_name = args.group_name
-    if not group_name.endswith('.boxes'):
-        ALIAS = group_name.lower()
-        group_name = group_name + '.boxes'
-    else:
-        ALIAS = group_name.replace('.boxes').lower()
-    return group_name
+    return args.group_name
+
+
+def parse_command_args(parser, args, command):
+    """
+    Options can also follow the command name, for example "boxer --group-name input start --detach".
+    For "exec" everything after the first positional argument is the command to be executed in the container.
+    """
+    words = []
+    rest = args.command[1:]
+    while rest:
+        parser.parse_args(rest, namespace=args)
+        if command == 'exec':
+            words.extend(args.command)
+            break
+        if not args.command:
+            break
+        words.append(args.command[0])
+        rest = args.command[1:]
+    args.command = [command, ] + words
+    return args
 
 
 def main():
-    global VERBOSE
-    global QUITE_PULL
-    global ALIAS
-
     parser = CustomArgumentParser(
         prog='boxer',
         formatter_class=argparse.RawTextHelpFormatter,
@@ -435,13 +3662,97 @@ def main():
     )
     parser.add_argument(
         '-c', '--container', dest='container',
-        help='Name of the target container in the group where the command will be executed',
+        help='Name of the target container in the group where the command will be executed, or a comma separated list of names',
+    )
+    parser.add_argument(
+        '--all', dest='all', action='store_true', default=False,
+        help='Execute the command in all containers of the group at the same time, up to the "--jobs" number of them',
+    )
+    parser.add_argument(
+        '--gather', dest='gather', action='store_true', default=False,
+        help='Print the output of every container at once when its command has finished instead of streaming it line by line',
+    )
+    parser.add_argument(
+        '-j', '--jobs', dest='jobs', type=int, default=os.cpu_count() or 1,
+        help='Maximum number of "checkout.sh", "exec.sh", "commit.sh" and "push.sh" scripts running at the same time',
+    )
+    parser.add_argument(
+        '-f', '--force', dest='force', action='store_const', const=True, default=False,
+        help='Build all of the boxes, even those which were not changed since the last successful build, or rebuild and recreate running containers on "start"',
+    )
+    parser.add_argument(
+        '-t', '--timings', dest='timings', action='store_const', const=True, default=False,
+        help='Print a table with the time spent on every step and every box',
+    )
+    parser.add_argument(
+        '--timeout', dest='timeout', type=float, default=None,
+        help='Maximum number of seconds every "checkout.sh", "exec.sh", "commit.sh" and "push.sh" script can run',
+    )
+    parser.add_argument(
+        '--cache-dir', dest='cache_dir',
+        help='Location of the shared cache used by "checkout.yml" files and by "export" and "import" commands, default is $BOXER_CACHE_DIR or ~/.cache/boxer',
+    )
+    parser.add_argument(
+        '--build-backend', dest='build_backend', choices=('compose', 'buildx', ), default='compose',
+        help='Let "docker-compose up --build" build all images at once, or build image of every box with "docker buildx build" using a local layers cache',
+    )
+    parser.add_argument(
+        '--pipeline', dest='pipeline', action='store_true', default=False,
+        help='Run "exec.sh", "commit.sh" and "push.sh" of every box one after another as soon as the box is ready instead of waiting for all boxes on every step',
+    )
+    parser.add_argument(
+        '--log-max-size', dest='log_max_size', type=float, default=10,
+        help='Maximum size in megabytes of every log file in the "logs" folder of the group before it is rotated, default is 10',
+    )
+    parser.add_argument(
+        '--log-compress', dest='log_compress', action='store_true', default=False,
+        help='Compress rotated log files with gzip',
+    )
+    parser.add_argument(
+        '-b', '--batch', dest='batch',
+        help='File with commands to be executed one by one via a single shell session in every target container, use "-" to read from STDIN',
+    )
+    parser.add_argument(
+        '-r', '--replicas', dest='replicas', type=int, default=1,
+        help='Number of isolated copies of the group to start, or to execute the command in',
+    )
+    parser.add_argument(
+        '-d', '--detach', dest='detach', action='store_const', const=True, default=False,
+        help='Start containers in the background and return',
+    )
+    parser.add_argument(
+        '-w', '--wait', dest='wait', action='store_const', const=True, default=False,
+        help='Start containers in the background and wait until all of the services are ready',
+    )
+    parser.add_argument(
+        '--wait-timeout', dest='wait_timeout', type=float, default=300,
+        help='Maximum number of seconds to wait for the services to be ready, default is 300',
+    )
+    parser.add_argument(
+        '--write-dockerignore', dest='write_dockerignore', action='store_true', default=False,
+        help='Let "context-report" command replace ".dockerignore" files with a list of files used by "COPY" and "ADD" instructions',
+    )
+    parser.add_argument(
+        '--duration', dest='duration', type=float, default=60,
+        help='Number of seconds the "stats" command collects resource usage of running containers, default is 60',
+    )
+    parser.add_argument(
+        '--interval', dest='interval', type=float, default=5,
+        help='Number of seconds between two samples of the "stats" command, default is 5',
+    )
+    parser.add_argument(
+        '--debounce', dest='debounce', type=float, default=0.5,
+        help='Number of seconds the "watch" command waits after the last change of a file before it builds and recreates containers, default is 0.5',
+    )
+    parser.add_argument(
+        '--stats-output', dest='stats_output',
+        help='File where the "stats" command saves the samples, CSV when the file name ends with ".csv" and JSON lines otherwise, default is "stats.jsonl" in the group folder',
     )
     parser.add_argument(
         'command',
         default='',
         nargs=argparse.REMAINDER,
-        help='A command you are going to execute: init, build, start, exec, stop',
+        help='A command you are going to execute: init, build, start, exec, stop, checkpoint, reset, stats, context-report, plan, export, import, watch',
     )
 
     args = parser.parse_args()
@@ -452,116 +3763,122 @@ def main():
     if not command:
         command = 'help'
 
-    if args.quite:
-        VERBOSE = '1>boxer_stdout.txt 2>boxer_stderr.txt'
-        QUITE_PULL = '--quiet-pull '
-
     if command == 'help':
         parser.print_help()
         return
 
-    if command == 'init':
-        init_parser = argparse.ArgumentParser(
-            prog='boxer',
-        )
-        init_parser.add_argument(
-            '-q', '--quite', dest='quite', action='store_const', const=True, default=False,
-        )
-        init_parser.add_argument(
-            '-g', '--group-name', dest='group_name',
-            help='Name of the target group of containers',
-        )
-        init_parser.add_argument(
-            'init',
-        )
-        init_parser.add_argument(
-            'container',
-            nargs='+',
-            action='extend',
-            help='Containers names to be added to the group',
-        )
-        init_args = init_parser.parse_args()
+    args = parse_command_args(parser, args, command)
+
+    try:
+        run_cli(parser, args, command)
+    except BoxerError as e:
+        sys.exit(e.exit_code)
+
+
+def make_group(args, group_name):
+    return Group(
+        group_name,
+        quite=args.quite,
+        jobs=args.jobs,
+        force=args.force,
+        timeout=args.timeout,
+        cache_dir=args.cache_dir,
+        build_backend=args.build_backend,
+        log_max_size=args.log_max_size,
+        log_compress=args.log_compress,
+        timings=args.timings,
+        wait_timeout=args.wait_timeout,
+        pipeline=args.pipeline,
+    )
 
-        if not init_args.container:
+
+def run_cli(parser, args, command):
+    if command == 'init':
+        containers = args.command[1:]
+        if not containers:
             print('must provide a name for at least one container to be added to the group')
             sys.exit(1)
             return
 
-        if '-h' == init_args.container[0] or '--help' == init_args.container[0]:
-            init_args.print_help()
-            return
-
-        group_name = get_group_name(init_args)
-        init_group(group_name, init_args.container)
+        make_group(args, get_group_name(args)).init(containers)
         return
 
     if command == 'build':
-        group_name = get_group_name(args)
-        group_dir = os.path.join(os.getcwd(), group_name)
-        print(f'<BOXER> network group name is [{group_name}]')
-        print(f'<BOXER> target folder is [{group_dir}]')
-        generate_docker_compose_build_file(group_name)
-        check_ret(execute_docker_compose_build_down(group_name))
-        check_ret(execute_checkout(group_name))
-        check_ret(execute_docker_compose_build(group_name))
-        check_ret(execute_docker_exec(group_name))
-        check_ret(execute_docker_commit(group_name))
-        check_ret(execute_docker_push(group_name))
-        check_ret(execute_docker_compose_build_down(group_name))
-        print('<BOXER> done')
+        make_group(args, get_group_name(args)).build()
         return
 
     if command == 'start':
-        group_name = get_group_name(args)
-        group_dir = os.path.join(os.getcwd(), group_name)
-        print(f'<BOXER> network group name is [{group_name}]')
-        print(f'<BOXER> target folder is [{group_dir}]')
-        generate_docker_compose_run_file(group_name)
-        check_ret(execute_docker_compose_run(group_name))
-        print('<BOXER> done')
+        make_group(args, get_group_name(args)).start(detach=args.detach, wait=args.wait, replicas=args.replicas)
         return
 
     if command == 'stop':
-        group_name = get_group_name(args)
-        group_dir = os.path.join(os.getcwd(), group_name)
-        print(f'<BOXER> network group name is [{group_name}]')
-        print(f'<BOXER> target folder is [{group_dir}]')
-        check_ret(execute_docker_compose_run_down(group_name))
+        make_group(args, get_group_name(args)).stop()
+        return
+
+    if command == 'checkpoint':
+        make_group(args, get_group_name(args)).checkpoint()
+        return
+
+    if command == 'reset':
+        make_group(args, get_group_name(args)).reset()
+        return
+
+    if command == 'watch':
+        group = make_group(args, get_group_name(args))
+        print(f'<BOXER> network group name is [{group.group_name}]')
+        group.watch(debounce=args.debounce)
+        print('<BOXER> done')
+        return
+
+    if command == 'export':
+        make_group(args, get_group_name(args)).export_images()
+        return
+
+    if command == 'import':
+        make_group(args, get_group_name(args)).import_images()
+        return
+
+    if command == 'stats':
+        group = make_group(args, get_group_name(args))
+        print(f'<BOXER> network group name is [{group.group_name}]')
+        if group.stats(duration=args.duration, interval=args.interval, output=args.stats_output) is None:
+            check_ret(1)
+        print('<BOXER> done')
+        return
+
+    if command == 'plan':
+        target = args.command[1] if len(args.command) > 1 else 'build'
+        if target not in ('build', 'start', ):
+            print('only "build" and "start" commands can be planned')
+            sys.exit(1)
+            return
+        group = make_group(args, get_group_name(args))
+        print(f'<BOXER> network group name is [{group.group_name}]')
+        group.plan(target)
+        print('<BOXER> done')
+        return
+
+    if command == 'context-report':
+        group = make_group(args, get_group_name(args))
+        print(f'<BOXER> network group name is [{group.group_name}]')
+        print(f'<BOXER> target folder is [{os.path.abspath(group.group_name)}]')
+        group.context_report(write=args.write_dockerignore)
         print('<BOXER> done')
         return
 
     if command == 'exec':
-        exec_parser = argparse.ArgumentParser(
-            prog='boxer',
-        )
-        exec_parser.add_argument(
-            '-q', '--quite', dest='quite', action='store_const', const=True, default=False,
-        )
-        exec_parser.add_argument(
-            '-g', '--group-name', dest='group_name',
-            help='Name of the target group of containers',
-        )
-        exec_parser.add_argument(
-            '-c', '--container', dest='container',
-            help='Name of the target container in the group where the command will be executed',
-        )
-        exec_parser.add_argument(
-            'exec',
-        )
-        exec_parser.add_argument(
-            'command',
-            help='Command and arguments to be executed inside of the target container',
-            nargs=argparse.PARSER,
-        )
-        exec_args = exec_parser.parse_args()
-        if exec_args.command:
-            if '-h' == exec_args.command[0] or '--help' == exec_args.command[0]:
-                exec_parser.print_help()
-                return
+        if len(args.command) < 2 and not args.batch:
+            print('must provide a command to be executed or a file with commands, use the "--batch" argument')
+            sys.exit(1)
+            return
 
-        group_name = get_group_name(exec_args)
-        print(f'<BOXER> network group name is [{group_name}]')
-        check_ret(execute_docker_compose_run_exec(group_name, exec_args.container, args.command[1:]))
+        group = make_group(args, get_group_name(args))
+        print(f'<BOXER> network group name is [{group.group_name}]')
+        container = group.services() if args.all else args.container
+        if args.batch:
+            check_ret(group.exec_batch(container, args.batch))
+        else:
+            check_ret(group.exec_stream(container, args.command[1:], replicas=args.replicas, gather=args.gather))
         print('<BOXER> done')
         return
 